@@ -13,6 +13,9 @@ import subprocess
 import importlib
 import os
 import platform
+import shutil
+import argparse
+import random
 
 # Auto-install required packages
 def install_if_needed(package_name, import_name=None):
@@ -48,93 +51,278 @@ for package, import_name in packages:
 
 # Now import everything
 import pandas as pd
+import numpy as np
 import json
 import time
+import csv
+import html
+import threading
+import sqlite3
+import hashlib
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.parse import urlparse, parse_qs
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.chrome.service import Service
+from selenium.common.exceptions import WebDriverException, TimeoutException, InvalidSessionIdException
 from webdriver_manager.chrome import ChromeDriverManager
 from colorama import init, Fore, Style
 
 # Initialize colorama for colored output
 init()
 
-def get_chrome_profiles():
-    """Get list of available Chrome profiles including custom ones"""
-    system = platform.system()
-    profiles = []
-    custom_profiles = []
+DEFAULT_MOODLE_URL = "https://moodle.innopolis.university/mod/assign/view.php?id=131683&action=grading"
+
+# URL patterns blocked by the fast launch profile. Avatars, theme images,
+# fonts and media are never needed to read or fill the quick grading table.
+BLOCKED_RESOURCE_PATTERNS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg", "*.ico",
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+    "*.mp4", "*.webm", "*.mp3", "*.ogg",
+    "*/theme/image.php/*",
+    "*/theme/font.php/*",
+    "*/pluginfile.php/*/user/icon/*",
+]
+
+# Moodle's default grade letter boundaries, as a percentage of the maximum grade
+LETTER_GRADE_PERCENT = {
+    'A': 93, 'A-': 90, 'B+': 87, 'B': 83, 'B-': 80,
+    'C+': 77, 'C': 73, 'C-': 70, 'D+': 67, 'D': 60, 'F': 0,
+}
+
+# Profile registry: custom profiles, cached Chrome profile scan, Moodle logins
+PROFILES_FILE = os.path.expanduser("~/.moodle_grader_profiles.json")
+
+# Custom profile folders looked for in the home directory on first run
+KNOWN_CUSTOM_PROFILES = [
+    "moodle-grading",
+    ".moodle-grading",
+    "moodle_grading_profile",
+    ".moodle_grading_profile",
+    ".moodle_temp_profile",
+]
+
+# Temporary profile, and the per-worker profile copies for parallel sessions
+TEMP_PROFILE = os.path.expanduser("~/.moodle_temp_profile")
+WORKER_PROFILES_DIR = os.path.expanduser("~/.moodle_grader_workers")
+
+# Caches and lock files a profile copy does not need
+CLONE_IGNORE = [
+    "Singleton*", "lockfile", "Cache", "Code Cache", "GPUCache", "DawnCache", "GrShaderCache",
+    "ShaderCache", "Service Worker", "Crashpad", "component_crx_cache", "Safe Browsing",
+    "OptimizationGuidePredictionModels", "optimization_guide_model_store",
+]
+
+# How a pipeline source combines several rows for one student
+PIPELINE_COMBINE = ['mean', 'max', 'min']
+
+# Detected grade scales per assignment, used when the page does not show one
+CACHE_FILE = os.path.expanduser("~/.moodle_grader_cache.json")
+
+# Quick grading grade fields (quickgrade_<id>): text inputs for points, selects
+# for scales. With marking workflow the table also has quickgrade_<id>_workflowstate
+# and quickgrade_<id>_allocatedmarker selects; page scripts keep only names
+# matching /^quickgrade_\d+$/, CSS can only leave them out by suffix.
+GRADE_FIELD_SELECTOR = ", ".join(
+    f"{tag}[name^='quickgrade_']:not([name^='quickgrade_comments_'])"
+    ":not([name$='_workflowstate']):not([name$='_allocatedmarker'])"
+    for tag in ('input', 'select')
+)
+
+# Quick grading save button, tried one selector at a time in this order
+# (a selector list would match in document order, e.g. a navbar search button)
+SAVE_BUTTON_SELECTORS = ['[name="savequickgrades"]', 'input[value*="Save"]', 'input[name="savechanges"]', 'button[type="submit"]']
+
+# Third-party hosts (analytics, web fonts, avatars) that themes pull in
+BLOCKED_THIRD_PARTY_HOSTS = [
+    "*google-analytics.com*",
+    "*googletagmanager.com*",
+    "*doubleclick.net*",
+    "*fonts.googleapis.com*",
+    "*fonts.gstatic.com*",
+    "*gravatar.com*",
+    "*mc.yandex.ru*",
+    "*connect.facebook.net*",
+    "*hotjar.com*",
+]
 
+def chrome_user_data_dir():
+    """Chrome's own user data directory for this platform (None if unknown)"""
+    system = platform.system()
     if system == "Linux":
-        profile_path = os.path.expanduser("~/.config/google-chrome")
+        return os.path.expanduser("~/.config/google-chrome")
     elif system == "Windows":
-        profile_path = os.path.expandvars(r"%LOCALAPPDATA%\Google\Chrome\User Data")
+        return os.path.expandvars(r"%LOCALAPPDATA%\Google\Chrome\User Data")
     elif system == "Darwin":  # macOS
-        profile_path = os.path.expanduser("~/Library/Application Support/Google/Chrome")
-    else:
-        return profiles, custom_profiles
-
-    if os.path.exists(profile_path):
-        # Look for Profile directories
-        for item in os.listdir(profile_path):
-            if item == "Default" or item.startswith("Profile "):
-                profiles.append(item)
-
-    # Check for known custom profiles in home directory
-    home = os.path.expanduser("~")
-    custom_profile_names = [
-        "moodle-grading",
-        ".moodle-grading",
-        "moodle_grading_profile",
-        ".moodle_grading_profile",
-        ".moodle_temp_profile"
-    ]
+        return os.path.expanduser("~/Library/Application Support/Google/Chrome")
+    return None
 
-    for profile_name in custom_profile_names:
-        profile_path = os.path.join(home, profile_name)
-        if os.path.exists(profile_path):
-            custom_profiles.append(profile_path)
-
-    # Also check for a saved profiles list
-    config_file = os.path.join(home, ".moodle_grader_profiles.json")
-    if os.path.exists(config_file):
+def load_profile_registry():
+    """Load the profile registry (profiles, Chrome profile scan, Moodle logins)"""
+    if os.path.exists(PROFILES_FILE):
         try:
-            import json
-            with open(config_file, 'r') as f:
-                saved_profiles = json.load(f)
-                for p in saved_profiles.get('custom_profiles', []):
-                    if os.path.exists(p) and p not in custom_profiles:
-                        custom_profiles.append(p)
+            with open(PROFILES_FILE, 'r') as f:
+                return json.load(f)
         except:
             pass
+    return {}
+
+def save_profile_registry(registry):
+    """Write the profile registry"""
+    try:
+        with open(PROFILES_FILE, 'w') as f:
+            json.dump(registry, f, indent=2)
+    except:
+        pass
 
+def profile_key(profile_name=None, custom_path=None):
+    """Registry key of a profile: its path, 'chrome:<name>' or 'temp'"""
+    if custom_path:
+        return custom_path
+    if profile_name:
+        return f"chrome:{profile_name}"
+    return 'temp'
+
+def profile_from_key(key):
+    """Turn a registry key back into (profile_name, custom_path)"""
+    if key == 'temp':
+        return None, None
+    if key.startswith('chrome:'):
+        return key[len('chrome:'):], None
+    return None, key
+
+def mark_login(profile_name, custom_path, moodle_url):
+    """Remember that the profile just reached a Moodle grading page, i.e. is logged in"""
+    registry = load_profile_registry()
+    logins = registry.setdefault('logins', {}).setdefault(profile_key(profile_name, custom_path), {})
+    logins[urlparse(moodle_url).netloc] = datetime.now().isoformat(timespec='seconds')
+    save_profile_registry(registry)
+
+def describe_login(registry, key, host):
+    """Short login freshness tag for the profile menu, e.g. '🔑 moodle.example.edu 3h ago'"""
+    logged_in = registry.get('logins', {}).get(key, {}).get(host)
+    if not logged_in:
+        return ""
+    hours = (datetime.now() - datetime.fromisoformat(logged_in)).total_seconds() / 3600
+    age = f"{hours * 60:.0f}m" if hours < 1 else f"{hours:.0f}h" if hours < 48 else f"{hours / 24:.0f}d"
+    return f"  🔑 {host} {age} ago"
+
+def get_chrome_profiles(registry=None):
+    """Get list of available Chrome profiles including custom ones
+
+    The Chrome profile list is cached in the registry and only rescanned when
+    Chrome's user data directory changed. Known custom profile folders are
+    looked for once; after that the registry is the list.
+    """
+    if registry is None:
+        registry = load_profile_registry()
+    profiles = []
+    changed = False
+
+    profile_path = chrome_user_data_dir()
+    if profile_path and os.path.exists(profile_path):
+        mtime = os.path.getmtime(profile_path)
+        cached = registry.get('chrome', {})
+        if cached.get('path') == profile_path and cached.get('mtime') == mtime:
+            profiles = cached['profiles']
+        else:
+            # Look for Profile directories
+            for item in os.listdir(profile_path):
+                if item == "Default" or item.startswith("Profile "):
+                    profiles.append(item)
+            registry['chrome'] = {'path': profile_path, 'mtime': mtime, 'profiles': profiles}
+            changed = True
+
+    if not registry.get('scanned'):
+        # Check for known custom profiles in home directory
+        home = os.path.expanduser("~")
+        saved = registry.setdefault('custom_profiles', [])
+        for profile_name in KNOWN_CUSTOM_PROFILES:
+            path = os.path.join(home, profile_name)
+            if os.path.exists(path) and path not in saved:
+                saved.append(path)
+        registry['scanned'] = True
+        changed = True
+
+    if changed:
+        save_profile_registry(registry)
+
+    custom_profiles = [p for p in registry.get('custom_profiles', []) if os.path.exists(p)]
     return profiles, custom_profiles
 
 def save_custom_profile(profile_path):
     """Save custom profile path for future use"""
-    config_file = os.path.expanduser("~/.moodle_grader_profiles.json")
-    saved_profiles = {'custom_profiles': []}
-
-    if os.path.exists(config_file):
-        try:
-            with open(config_file, 'r') as f:
-                saved_profiles = json.load(f)
-        except:
-            pass
+    registry = load_profile_registry()
+    if profile_path not in registry.get('custom_profiles', []):
+        registry.setdefault('custom_profiles', []).append(profile_path)
+        save_profile_registry(registry)
 
-    if profile_path not in saved_profiles.get('custom_profiles', []):
-        saved_profiles.setdefault('custom_profiles', []).append(profile_path)
-        try:
-            with open(config_file, 'w') as f:
-                json.dump(saved_profiles, f, indent=2)
-        except:
-            pass
+def resolve_profile(spec, registry, profiles, custom_profiles, host):
+    """Pick a profile without asking
 
-def select_chrome_profile():
-    """Let user select which Chrome profile to use"""
-    profiles, custom_profiles = get_chrome_profiles()
+    spec is 'auto' (the profile that most recently reached a grading page on
+    this Moodle host), 'temp', a Chrome profile name, or a custom profile
+    name or path.
+    """
+    if spec == 'auto':
+        known = {'temp'} | {profile_key(p) for p in profiles} | set(custom_profiles)
+        fresh = [(hosts[host], key) for key, hosts in registry.get('logins', {}).items()
+                 if key in known and host in hosts]
+        if not fresh:
+            print(f"→ No profile has logged in to {host} yet, using temporary profile")
+            return None, None
+        logged_in, key = max(fresh)
+        profile_name, custom_path = profile_from_key(key)
+        print(f"→ Using {profile_name or custom_path or 'temporary profile'} (logged in to {host} at {logged_in})")
+        return profile_name, custom_path
+
+    if spec == 'temp':
+        print("→ Using temporary profile")
+        return None, None
+    if spec in profiles:
+        print(f"→ Selected: {spec}")
+        return spec, None
+    for path in custom_profiles:
+        if spec in (path, os.path.basename(path)):
+            print(f"→ Using custom profile: {path}")
+            return None, path
+    if os.path.sep in spec or spec.startswith('~'):
+        custom_path = os.path.abspath(os.path.expanduser(spec))
+        print(f"→ Using custom path: {custom_path}")
+        save_custom_profile(custom_path)
+        return None, custom_path
+
+    print(f"{Fore.RED}❌ Unknown profile '{spec}'. Use 'auto', 'temp', a Chrome profile "
+          f"({', '.join(profiles) or 'none found'}) or a custom profile name or path{Style.RESET_ALL}")
+    sys.exit(1)
+
+def list_profiles():
+    """Print every known profile with the Moodle hosts it is logged in to"""
+    registry = load_profile_registry()
+    profiles, custom_profiles = get_chrome_profiles(registry)
+    keys = ['temp'] + [profile_key(p) for p in profiles] + custom_profiles
+    logins = registry.get('logins', {})
+
+    print("\n🌐 Known profiles (use with --profile):")
+    for key in keys:
+        profile_name, custom_path = profile_from_key(key)
+        print(f"  {profile_name or custom_path or 'temp'}")
+        for host in sorted(logins.get(key, {})):
+            print(f"    {describe_login(registry, key, host).strip()}")
+
+def select_chrome_profile(spec=None, moodle_url=None):
+    """Let user select which Chrome profile to use, or resolve --profile without asking"""
+    registry = load_profile_registry()
+    profiles, custom_profiles = get_chrome_profiles(registry)
+    host = urlparse(moodle_url).netloc if moodle_url else ""
+
+    if spec:
+        return resolve_profile(spec, registry, profiles, custom_profiles, host)
 
     print("\n" + "="*60)
     print("🌐 CHROME PROFILE SELECTION")
@@ -143,7 +331,7 @@ def select_chrome_profile():
     option_num = 0
     options_map = {}
 
-    print(f"\n{option_num}. 🆕 Create temporary profile (will need to log in)")
+    print(f"\n{option_num}. 🆕 Create temporary profile (will need to log in){describe_login(registry, 'temp', host)}")
     options_map[option_num] = ('temp', None)
     option_num += 1
 
@@ -151,10 +339,11 @@ def select_chrome_profile():
     if profiles:
         print("\n📂 Chrome Profiles:")
         for profile in profiles:
+            login = describe_login(registry, profile_key(profile), host)
             if profile == "Default":
-                print(f"{option_num}. 👤 Main Profile (Default)")
+                print(f"{option_num}. 👤 Main Profile (Default){login}")
             else:
-                print(f"{option_num}. 👤 {profile}")
+                print(f"{option_num}. 👤 {profile}{login}")
             options_map[option_num] = ('profile', profile)
             option_num += 1
 
@@ -167,7 +356,7 @@ def select_chrome_profile():
                 icon = "🎓"
             else:
                 icon = "📁"
-            print(f"{option_num}. {icon} {profile_name}")
+            print(f"{option_num}. {icon} {profile_name}{describe_login(registry, custom_path, host)}")
             if custom_path != profile_name:
                 print(f"     Path: {custom_path}")
             options_map[option_num] = ('custom', custom_path)
@@ -258,15 +447,245 @@ def load_grades(input_file):
 
     return df
 
+def load_pipeline_file(path, base_dir, frames):
+    """Load a pipeline input file once, however many sources use it"""
+    if not os.path.isabs(path):
+        path = os.path.join(base_dir, path)
+    if path not in frames:
+        frames[path] = load_grades(path)
+    return path, frames[path]
+
+def read_source_scores(source, base_dir, frames):
+    """Load one pipeline source and return its scores (0-1), names and feedback by email"""
+    path, df = load_pipeline_file(source['file'], base_dir, frames)
+
+    email_col, name_col, _, _ = find_grade_columns(df)
+    column = source['column']
+    if not email_col or column not in df.columns:
+        print(f"❌ Error: {path} needs an email column and a '{column}' column")
+        sys.exit(1)
+
+    df = df[df[email_col].notna()]
+    email = df[email_col].astype(str).str.lower().str.strip()
+
+    raw = df[column].astype(str).str.strip().str.replace(',', '.', regex=False)
+    score = pd.to_numeric(raw, errors='coerce')
+    if 'cap' in source:
+        score = score.clip(upper=source['cap'])
+    score = score / source.get('out_of', 100)
+
+    # Several rows per student (e.g. several graders) are combined
+    scores = score.groupby(email).agg(source.get('combine', 'mean'))
+
+    names = None
+    if name_col:
+        names = df[name_col].groupby(email).first()
+
+    feedback = None
+    if source.get('feedback') and source['feedback'] in df.columns:
+        feedback = df[source['feedback']].where(df[source['feedback']].notna(), '').astype(str)
+        feedback = feedback.groupby(email).agg(lambda texts: '\n'.join(t for t in texts if t))
+
+    return scores, names, feedback
+
+def late_days(late, base_dir, frames):
+    """Late days per email, from a days column or from submission timestamps"""
+    path, df = load_pipeline_file(late['file'], base_dir, frames)
+
+    email_col, _, _, _ = find_grade_columns(df)
+    column = late['days_column'] if 'days_column' in late else late['submitted_column']
+    if not email_col or column not in df.columns:
+        print(f"❌ Error: {path} needs an email column and a '{column}' column")
+        sys.exit(1)
+    df = df[df[email_col].notna()]
+    email = df[email_col].astype(str).str.lower().str.strip()
+
+    if 'days_column' in late:
+        days = pd.to_numeric(df[late['days_column']], errors='coerce').fillna(0)
+    else:
+        try:
+            deadline = pd.Timestamp(late['deadline'])
+        except (ValueError, TypeError):
+            print(f"❌ Error: late deadline '{late['deadline']}' is not a date (e.g. 2026-10-01 23:59)")
+            sys.exit(1)
+        submitted = pd.to_datetime(df[late['submitted_column']], errors='coerce')
+        overdue = (submitted - deadline) / pd.Timedelta(days=1)
+        days = np.ceil(overdue.fillna(0)).clip(lower=0)
+
+    days = (days - late.get('grace_days', 0)).clip(lower=0)
+    return days.groupby(email).max()
+
+def check_pipeline_spec(spec):
+    """Return a list of problems with a pipeline spec (missing keys, wrong types, unknown names)"""
+    if not isinstance(spec, dict) or not isinstance(spec.get('sources'), list) or not spec['sources']:
+        return ["'sources' must be a non-empty list"]
+
+    problems = []
+    names = set()
+    for i, source in enumerate(spec['sources']):
+        if not isinstance(source, dict):
+            problems.append(f"source {i + 1} must be an object")
+            continue
+        missing = [key for key in ('name', 'file', 'column') if key not in source]
+        if missing:
+            problems.append(f"source {source.get('name', i + 1)} needs {', '.join(missing)}")
+        if source.get('combine', 'mean') not in PIPELINE_COMBINE:
+            problems.append(f"source {source.get('name', i + 1)}: combine must be one of {', '.join(PIPELINE_COMBINE)}")
+        names.add(source.get('name'))
+
+    best_of = spec.get('best_of', [])
+    if not isinstance(best_of, list):
+        problems.append("'best_of' must be a list")
+        best_of = []
+    for i, group in enumerate(best_of):
+        if not isinstance(group, dict):
+            problems.append(f"best_of {i + 1} must be an object")
+            continue
+        missing = [key for key in ('name', 'sources', 'n') if key not in group]
+        if missing:
+            problems.append(f"best_of {group.get('name', i + 1)} needs {', '.join(missing)}")
+            continue
+        if not isinstance(group['sources'], list):
+            problems.append(f"best_of {group['name']}: sources must be a list of source names")
+            continue
+        unknown = [name for name in group['sources'] if name not in names]
+        if unknown:
+            problems.append(f"best_of {group['name']} uses unknown sources: {', '.join(map(str, unknown))}")
+        if not isinstance(group['n'], int) or isinstance(group['n'], bool) or group['n'] < 1:
+            problems.append(f"best_of {group['name']}: n must be a positive whole number")
+
+    late = spec.get('late')
+    if late is not None and not isinstance(late, dict):
+        problems.append("'late' must be an object")
+    elif late:
+        missing = [key for key in ('file', 'penalty_per_day') if key not in late]
+        if 'days_column' not in late and not ('submitted_column' in late and 'deadline' in late):
+            missing.append("days_column (or submitted_column and deadline)")
+        if missing:
+            problems.append(f"late needs {', '.join(missing)}")
+
+    return problems
+
+def run_grade_pipeline(spec_file):
+    """Compute final grades from several score sheets described in a JSON spec
+
+    Sources are joined on email; each gives a column scaled to 0-1 by its
+    'out_of' (after an optional 'cap'). 'best_of' groups average the best
+    'n' of their sources. Weighted components are combined, scaled to
+    'max_grade', reduced by late-day penalties and clipped. The result has
+    Email, Student Name, Grade and Feedback columns like a grades file.
+    """
+    print(f"🧪 Running grade pipeline {spec_file}...")
+    try:
+        with open(spec_file, 'r') as f:
+            spec = json.load(f)
+    except Exception as e:
+        print(f"❌ Error loading pipeline spec: {e}")
+        sys.exit(1)
+
+    problems = check_pipeline_spec(spec)
+    if problems:
+        print(f"❌ Error: invalid pipeline spec {spec_file}:")
+        for problem in problems:
+            print(f"   - {problem}")
+        sys.exit(1)
+
+    base_dir = os.path.dirname(os.path.abspath(spec_file))
+    max_grade = spec.get('max_grade', 100)
+
+    frames = {}
+    columns = {}
+    names = []
+    feedbacks = []
+    for source in spec['sources']:
+        scores, source_names, feedback = read_source_scores(source, base_dir, frames)
+        columns[source['name']] = scores
+        if source_names is not None:
+            names.append(source_names)
+        if feedback is not None:
+            feedbacks.append(feedback)
+
+    # Outer join of all sources on email
+    scores = pd.concat(columns, axis=1).fillna(spec.get('missing', 0))
+
+    weights = {source['name']: source['weight'] for source in spec['sources'] if source.get('weight')}
+
+    for group in spec.get('best_of', []):
+        # Sort each student's scores descending and average the best n
+        values = np.sort(scores[group['sources']].to_numpy(), axis=1)[:, ::-1]
+        scores[group['name']] = values[:, :group['n']].mean(axis=1)
+        if group.get('weight'):
+            weights[group['name']] = group['weight']
+
+    if not weights:
+        print("❌ Error: the pipeline spec needs at least one weighted source or best_of group")
+        sys.exit(1)
+
+    weight = pd.Series(weights)
+    total = scores[weight.index].mul(weight, axis=1).sum(axis=1) / weight.sum() * max_grade
+
+    penalized = 0
+    late = spec.get('late')
+    if late:
+        days = late_days(late, base_dir, frames).reindex(total.index).fillna(0)
+        penalty = (days * late['penalty_per_day']).clip(upper=late.get('max_penalty', 100))
+        total = total * (1 - penalty / 100)
+        penalized = int((penalty > 0).sum())
+
+    total = total.clip(lower=0, upper=spec.get('cap', max_grade)).round(spec.get('round', 2))
+
+    result = pd.DataFrame({'Email': total.index, 'Grade': total.to_numpy()})
+    if names:
+        all_names = names[0]
+        for more in names[1:]:
+            all_names = all_names.combine_first(more)
+        result['Student Name'] = result['Email'].map(all_names)
+    if feedbacks:
+        all_feedback = pd.concat(feedbacks, axis=1).fillna('')
+        all_feedback = all_feedback.agg(lambda texts: '\n'.join(t for t in texts if t), axis=1)
+        result['Feedback'] = result['Email'].map(all_feedback).fillna('')
+
+    print(f"✓ Computed {len(result)} grades from {len(spec['sources'])} sources "
+          f"(mean {result['Grade'].mean():.2f} / {max_grade:g})")
+    if late:
+        print(f"  ⏰ Late penalty applied to {penalized} students")
+
+    return result
+
+def load_input(input_file):
+    """Load grades from a CSV/Excel file, or compute them from a JSON pipeline spec"""
+    if input_file.endswith('.json'):
+        return run_grade_pipeline(input_file)
+    return load_grades(input_file)
+
 def extract_student_data_from_page(driver):
     """Extract student data from Moodle page including emails and IDs"""
     js_code = """
     var students = {};
 
-    // Method 1: Find all quickgrade inputs and work backwards
-    var gradeInputs = document.querySelectorAll('input[name^="quickgrade_"]');
+    // Diagnostics are only collected when tracing is on (arguments[0] = {samples: N})
+    var trace = arguments[0] ? {counts: {}, samples: {}} : null;
+    var sampleLimit = arguments[0] ? arguments[0].samples : 0;
+    function note(name, example) {
+        trace.counts[name] = (trace.counts[name] || 0) + 1;
+        if (example !== undefined) {
+            var list = trace.samples[name] || (trace.samples[name] = []);
+            if (list.length < sampleLimit) {
+                list.push(example);
+            }
+        }
+    }
 
-    console.log('Found ' + gradeInputs.length + ' grade input fields');
+    // Method 1: Find all quickgrade inputs (or scale selects) and work backwards;
+    // only quickgrade_<id>, not the marking workflow selects
+    var gradeInputs = Array.prototype.filter.call(
+        document.querySelectorAll('input[name^="quickgrade_"], select[name^="quickgrade_"]'),
+        function (field) { return /^quickgrade_\\d+$/.test(field.name); }
+    );
+
+    if (trace) {
+        trace.counts.grade_fields = gradeInputs.length;
+    }
 
     for (var i = 0; i < gradeInputs.length; i++) {
         var input = gradeInputs[i];
@@ -284,6 +703,8 @@ def extract_student_data_from_page(driver):
 
             if (emailCell) {
                 email = emailCell.textContent.trim();
+            } else if (trace) {
+                note('no_email_cell', userId);
             }
 
             // Try multiple selectors for name
@@ -306,8 +727,17 @@ def extract_student_data_from_page(driver):
                 }
             }
 
-            // Get current grade value
-            var currentGrade = input.value || '';
+            // Get current grade value (scales show the selected item, -1 is "No grade")
+            var currentGrade = '';
+            if (input.tagName === 'SELECT') {
+                if (input.value !== '-1' && input.selectedIndex >= 0) {
+                    currentGrade = input.options[input.selectedIndex].text.trim();
+                }
+            } else {
+                currentGrade = input.value || '';
+            }
+
+            var feedbackArea = row.querySelector('textarea[name="quickgrade_comments_' + userId + '"]');
 
             // Store the student data
             students[userId] = {
@@ -315,10 +745,16 @@ def extract_student_data_from_page(driver):
                 email: email.toLowerCase(),
                 name: name.trim(),
                 current_grade: currentGrade,
+                // null: the assignment has no feedback field on this page
+                current_feedback: feedbackArea ? feedbackArea.value : null,
                 field_exists: true
             };
 
-            console.log('Extracted student ' + userId + ': ' + name + ' (' + email + ')');
+            if (trace) {
+                note('extracted', userId + ': ' + name.trim() + ' (' + email + ')');
+            }
+        } else if (trace) {
+            note('no_row', userId);
         }
     }
 
@@ -333,7 +769,9 @@ def extract_student_data_from_page(driver):
         }
 
         if (!hasEmails) {
-            console.log('No emails found, trying alternative extraction...');
+            if (trace) {
+                note('email_fallback_used');
+            }
 
             // Try to find emails from the full table
             var allCells = document.querySelectorAll('td');
@@ -347,12 +785,17 @@ def extract_student_data_from_page(driver):
                     var parentRow = allCells[j].closest('tr');
                     if (parentRow) {
                         // Find if this row has a quickgrade input
-                        var rowInput = parentRow.querySelector('input[name^="quickgrade_"]');
+                        var rowInput = Array.prototype.find.call(
+                            parentRow.querySelectorAll('input[name^="quickgrade_"], select[name^="quickgrade_"]'),
+                            function (field) { return /^quickgrade_\\d+$/.test(field.name); }
+                        );
                         if (rowInput) {
                             var rowUserId = rowInput.name.replace('quickgrade_', '');
                             if (students[rowUserId]) {
                                 students[rowUserId].email = emailMatches[0].toLowerCase();
-                                console.log('Added email for ' + rowUserId + ': ' + emailMatches[0]);
+                                if (trace) {
+                                    note('fallback_email', rowUserId + ': ' + emailMatches[0]);
+                                }
                             }
                         }
                     }
@@ -361,36 +804,189 @@ def extract_student_data_from_page(driver):
         }
     }
 
-    console.log('Total students extracted: ' + Object.keys(students).length);
-    return students;
+    return {students: students, trace: trace};
     """
 
-    result = driver.execute_script(js_code)
+    with tracer.span('extract'):
+        result = driver.execute_script(js_code, {'samples': tracer.samples} if tracer.enabled else None)
+
+    if result['trace']:
+        tracer.merge('extract', result['trace'])
+
+    return result['students']
 
-    # Also check browser console for debugging
+def extract_grade_scale(driver):
+    """Read the maximum grade or the named scale items from the grading page"""
+    js_code = """
+    // Only grade fields (quickgrade_<id>), not the marking workflow selects
+    var fields = Array.prototype.filter.call(
+        document.querySelectorAll('input[name^="quickgrade_"], select[name^="quickgrade_"]'),
+        function (field) { return /^quickgrade_\\d+$/.test(field.name); }
+    );
+    var select = fields.find(function (field) { return field.tagName === 'SELECT'; });
+    if (select) {
+        var items = [];
+        for (var i = 0; i < select.options.length; i++) {
+            if (select.options[i].value !== '-1') {
+                items.push(select.options[i].text.trim());
+            }
+        }
+        return {type: 'scale', items: items};
+    }
+
+    // Point grades are shown as "[input] / 100.00" in the grade cell
+    var input = fields.find(function (field) { return field.tagName === 'INPUT'; });
+    if (input) {
+        var cell = input.closest('td') || input.parentElement;
+        var match = cell && cell.textContent.match(/\\/\\s*([0-9]+(?:[.,][0-9]+)?)/);
+        if (match) {
+            return {type: 'point', max: match[1]};
+        }
+    }
+    return null;
+    """
+
+    scale = driver.execute_script(js_code)
+    if scale and scale['type'] == 'point':
+        try:
+            scale['max'] = float(scale['max'].replace(',', '.'))
+        except ValueError:
+            return None
+    return scale
+
+def assignment_key(moodle_url):
+    """Stable key for an assignment: host plus the course module id"""
+    parsed = urlparse(moodle_url)
+    module_id = parse_qs(parsed.query).get('id')
+    if module_id:
+        return f"{parsed.netloc}/{module_id[0]}"
+    return moodle_url
+
+def load_cache():
+    """Load the local cache file"""
+    if os.path.exists(CACHE_FILE):
+        try:
+            with open(CACHE_FILE, 'r') as f:
+                return json.load(f)
+        except:
+            pass
+    return {}
+
+def save_cache(cache):
+    """Write the local cache file"""
     try:
-        logs = driver.get_log('browser')
-        for log in logs:
-            if 'console' in log['level'].lower():
-                print(f"  Browser console: {log['message']}")
+        with open(CACHE_FILE, 'w') as f:
+            json.dump(cache, f, indent=2)
     except:
-        pass  # Some configurations don't support browser logs
+        pass
+
+def resolve_grade_scale(driver, moodle_url, max_grade=None, scale_items=None):
+    """Work out the assignment's grade scale: command line, then page, then cache"""
+    if scale_items:
+        return {'type': 'scale', 'items': [item.strip() for item in scale_items.split(',') if item.strip()]}
+    if max_grade is not None:
+        return {'type': 'point', 'max': max_grade}
+
+    key = assignment_key(moodle_url)
+    cache = load_cache()
+    scale = extract_grade_scale(driver)
+
+    if scale:
+        if cache.get('scales', {}).get(key) != scale:
+            cache.setdefault('scales', {})[key] = scale
+            save_cache(cache)
+    else:
+        scale = cache.get('scales', {}).get(key)
+        if scale:
+            print("   (grade scale not shown on page, using cached one)")
 
-    return result
+    return scale
 
-def map_grades_to_students(df, moodle_students):
-    """Map CSV grades to Moodle students using email as primary key"""
+def describe_scale(scale):
+    """Short human readable description of a grade scale"""
+    if scale['type'] == 'scale':
+        return f"scale ({', '.join(scale['items'])})"
+    return f"points out of {scale['max']:g}"
 
-    # Hardcoded mappings as fallback (when emails not available)
-    NAME_TO_ID_FALLBACK = {
-        "Vladislav Borisov": "4407",
-        "Mukhammadamin Khatamov": "5254",
-        "Dmitry Ershov": "5288",
-        "Mekan Saryyev": "6425",
-        "Aliia Khadeeva": "6428"
-    }
+def validate_grades(df, scale):
+    """Normalize the whole grade column and split off rows that cannot be injected
 
-    # Find columns - handle both formats
+    Locale decimals ("95,5"), percentages and letter grades are converted to
+    points, and scale items are matched by name or number. Returns the valid
+    rows (with normalized grades), the invalid rows (with an 'Issue' column)
+    and the number of grades that were converted.
+    """
+    _, _, grade_col, _ = find_grade_columns(df)
+    if grade_col is None or scale is None:
+        return df, df.iloc[0:0], 0
+
+    raw = df[grade_col].astype(str).str.strip().mask(df[grade_col].isna(), '')
+    issue = pd.Series('', index=df.index, dtype=object)
+
+    if scale['type'] == 'scale':
+        by_text = {item.lower(): item for item in scale['items']}
+        by_number = {str(i): item for i, item in enumerate(scale['items'], 1)}
+        normalized = raw.str.lower().map(by_text)
+        normalized = normalized.fillna(raw.str.replace(r'\.0+$', '', regex=True).map(by_number))
+        issue = issue.mask(normalized.isna(), 'not in scale')
+    else:
+        max_grade = scale['max']
+        text = raw.str.replace(r'\s+', '', regex=True)
+        # "1.234,5" uses '.' for thousands; otherwise ',' is the decimal mark
+        both = text.str.contains('.', regex=False) & text.str.contains(',', regex=False)
+        text = text.mask(both, text.str.replace('.', '', regex=False)).str.replace(',', '.', regex=False)
+        percent = text.str.endswith('%')
+        numeric = pd.to_numeric(text.str.rstrip('%'), errors='coerce')
+        numeric = numeric.mask(percent, numeric * max_grade / 100)
+
+        letter = raw.str.upper().map(LETTER_GRADE_PERCENT)
+        numeric = numeric.mask(numeric.isna() & letter.notna(), letter * max_grade / 100)
+
+        issue = issue.mask(numeric.isna(), 'not a number')
+        issue = issue.mask(numeric < 0, 'negative grade')
+        issue = issue.mask(numeric > max_grade, f"above maximum {max_grade:g}")
+        normalized = numeric.round(2).astype(str).str.replace(r'\.0+$', '', regex=True)
+
+    issue = issue.mask(raw == '', 'empty grade')
+    bad = issue != ''
+
+    invalid = df[bad].copy()
+    invalid['Issue'] = issue[bad]
+
+    valid = df[~bad].copy()
+    converted = int((normalized[~bad] != raw[~bad]).sum())
+    valid[grade_col] = normalized[~bad]
+
+    return valid, invalid, converted
+
+def display_validation(scale, invalid, converted, top=10):
+    """Print the result of grade validation"""
+    print("\n🧮 Validating grades...")
+    if scale is None:
+        print(f"  {Fore.YELLOW}⚠️  Could not detect the grade scale, grades are not validated{Style.RESET_ALL}")
+        print("     Use --max-grade or --scale to set it")
+        return
+
+    print(f"  Grade type: {describe_scale(scale)}")
+    if converted:
+        print(f"  ✓ {converted} grades normalized (decimal commas, percentages, letters, scale numbers)")
+
+    if invalid.empty:
+        print(f"  {Fore.GREEN}✓ All grades are valid{Style.RESET_ALL}")
+        return
+
+    email_col, name_col, grade_col, _ = find_grade_columns(invalid)
+    print(f"  {Fore.RED}✗ {len(invalid)} invalid grades will NOT be injected:{Style.RESET_ALL}")
+    for issue, count in invalid['Issue'].value_counts().items():
+        print(f"    - {issue}: {count}")
+    for _, row in invalid.head(top).iterrows():
+        who = row[email_col] if email_col else row[name_col] if name_col else ''
+        print(f"  • {who}: {row[grade_col]!r} ({row['Issue']})")
+    if len(invalid) > top:
+        print(f"    ... and {len(invalid) - top} more (see report)")
+
+def find_grade_columns(df):
+    """Find the email, name, grade and feedback columns of a grades DataFrame"""
     email_col = None
     name_col = None
     grade_col = None
@@ -411,6 +1007,29 @@ def map_grades_to_students(df, moodle_students):
         elif 'feedback' in col_lower or 'comment' in col_lower:
             feedback_col = col
 
+    return email_col, name_col, grade_col, feedback_col
+
+def map_grades_to_students(df, moodle_students, verbose=False):
+    """Map CSV grades to Moodle students using email as primary key
+
+    Per-student lines are only printed when verbose is set; the full
+    result goes to the reports instead.
+    """
+
+    # Hardcoded mappings as fallback (when emails not available)
+    NAME_TO_ID_FALLBACK = {
+        "Vladislav Borisov": "4407",
+        "Mukhammadamin Khatamov": "5254",
+        "Dmitry Ershov": "5288",
+        "Mekan Saryyev": "6425",
+        "Aliia Khadeeva": "6428"
+    }
+
+    # Find columns - handle both formats
+    email_col, name_col, grade_col, feedback_col = find_grade_columns(df)
+    # Rollback files also carry the Moodle ID
+    id_col = next((col for col in df.columns if col.lower() == 'moodle id'), None)
+
     if not grade_col:
         print("❌ Error: Need a column with 'Grade' or 'Score' in the CSV/Excel")
         sys.exit(1)
@@ -422,6 +1041,12 @@ def map_grades_to_students(df, moodle_students):
     # Check if Moodle students have emails
     has_emails_in_moodle = any(s.get('email', '') for s in moodle_students.values())
 
+    # Email index so each CSV row is a dictionary lookup, not a scan of the page
+    email_index = {}
+    for student_id, student_data in moodle_students.items():
+        if student_data.get('email'):
+            email_index.setdefault(student_data['email'], student_id)
+
     # Build grades mapping
     matched_grades = {}
     unmatched = []
@@ -438,11 +1063,15 @@ def map_grades_to_students(df, moodle_students):
         csv_name = str(row[name_col]).strip() if name_col and pd.notna(row[name_col]) else None
         csv_grade = str(row[grade_col])
         csv_feedback = str(row[feedback_col]) if feedback_col and pd.notna(row[feedback_col]) else ""
+        csv_id = str(row[id_col]).strip() if id_col and pd.notna(row[id_col]) else None
 
         matches = []
 
+        # A Moodle ID identifies the student directly
+        if csv_id and csv_id in moodle_students:
+            matches.append((csv_id, moodle_students[csv_id], 'id'))
         # If Moodle has no emails, use fallback mapping
-        if not has_emails_in_moodle and csv_name:
+        elif not has_emails_in_moodle and csv_name:
             # Check hardcoded mappings
             for known_name, known_id in NAME_TO_ID_FALLBACK.items():
                 if known_name.lower() in csv_name.lower() or csv_name.lower() in known_name.lower():
@@ -451,11 +1080,9 @@ def map_grades_to_students(df, moodle_students):
                         break
         else:
             # Try to match by email first (most reliable)
-            if csv_email and has_emails_in_moodle:
-                for student_id, student_data in moodle_students.items():
-                    if student_data.get('email', '') == csv_email:
-                        matches.append((student_id, student_data, 'email'))
-                        break  # Email should be unique, stop after first match
+            if csv_email and csv_email in email_index:
+                student_id = email_index[csv_email]
+                matches.append((student_id, moodle_students[student_id], 'email'))
 
             # If no email match, try name (less reliable)
             if not matches and csv_name:
@@ -476,13 +1103,8 @@ def map_grades_to_students(df, moodle_students):
                 'match_type': match_type
             }
 
-            if match_type == 'email':
-                match_icon = "📧"
-            elif match_type == 'fallback':
-                match_icon = "🔗"
-            else:
-                match_icon = "👤"
-            print(f"  {match_icon} Matched: {csv_name} ({csv_email or 'no email'}) → Moodle ID {student_id}")
+            if verbose:
+                print(f"  {match_icon(match_type)} Matched: {csv_name} ({csv_email or 'no email'}) → Moodle ID {student_id}")
 
         elif len(matches) > 1:
             multiple_matches.append({
@@ -490,7 +1112,10 @@ def map_grades_to_students(df, moodle_students):
                 'csv_email': csv_email,
                 'matches': [(m[0], m[1]['name'], m[1]['email']) for m in matches]
             })
-            print(f"  ⚠️  Multiple matches for: {csv_name} ({csv_email})")
+            if verbose:
+                print(f"  ⚠️  Multiple matches for: {csv_name} ({csv_email})")
+            if tracer.enabled:
+                tracer.event('match.ambiguous', f"{csv_name} ({csv_email}): {len(matches)} candidates")
 
         else:
             unmatched.append({
@@ -498,12 +1123,174 @@ def map_grades_to_students(df, moodle_students):
                 'email': csv_email,
                 'grade': csv_grade
             })
-            print(f"  ❌ No match found: {csv_name} ({csv_email})")
+            if verbose:
+                print(f"  ❌ No match found: {csv_name} ({csv_email})")
+            if tracer.enabled:
+                tracer.event('match.unmatched', f"{csv_name} ({csv_email})")
+
+    print(f"  ✓ {len(matched_grades)} matched, {len(unmatched)} unmatched, "
+          f"{len(multiple_matches)} ambiguous")
 
     return matched_grades, unmatched, multiple_matches
 
-def display_analysis(matched_grades, unmatched, multiple_matches):
-    """Display detailed analysis of grade matching"""
+def grades_equal(a, b):
+    """Compare two grades, numerically when both are numbers ("95" == "95.00")"""
+    a = str(a).strip() if a is not None else ''
+    b = str(b).strip() if b is not None else ''
+    try:
+        return float(a.replace(',', '.')) == float(b.replace(',', '.'))
+    except ValueError:
+        return a == b
+
+def match_icon(match_type):
+    """Terminal icon for how a student was matched"""
+    if match_type == 'email':
+        return "📧"
+    elif match_type == 'fallback':
+        return "🔗"
+    elif match_type == 'id':
+        return "🆔"
+    return "👤"
+
+def iter_report_rows(matched_grades, unmatched, multiple_matches, invalid=None):
+    """Yield one flat row per CSV student with its analysis status
+
+    Status is one of: matched (empty grade will be filled), unchanged,
+    overwritten (existing grade will change), unmatched, ambiguous,
+    invalid (grade failed validation).
+    """
+    for student_id, data in matched_grades.items():
+        current = data['current_grade'] or ''
+        if not current.strip():
+            status = 'matched'
+        elif grades_equal(current, data['new_grade']):
+            status = 'unchanged'
+        else:
+            status = 'overwritten'
+        yield {
+            'status': status,
+            'moodle_id': student_id,
+            'name': data['name'],
+            'email': data['email'],
+            'current_grade': current,
+            'new_grade': data['new_grade'],
+            'feedback': data['new_feedback'],
+            'match_type': data.get('match_type', ''),
+            'candidates': '',
+            'issue': '',
+        }
+
+    for student in unmatched:
+        yield {
+            'status': 'unmatched',
+            'moodle_id': '',
+            'name': student['name'] or '',
+            'email': student['email'] or '',
+            'current_grade': '',
+            'new_grade': student['grade'],
+            'feedback': '',
+            'match_type': '',
+            'candidates': '',
+            'issue': '',
+        }
+
+    for item in multiple_matches:
+        yield {
+            'status': 'ambiguous',
+            'moodle_id': '',
+            'name': item['csv_name'] or '',
+            'email': item['csv_email'] or '',
+            'current_grade': '',
+            'new_grade': '',
+            'feedback': '',
+            'match_type': '',
+            'candidates': '; '.join(f"{mid}: {mname} ({memail})" for mid, mname, memail in item['matches']),
+            'issue': '',
+        }
+
+    if invalid is not None and not invalid.empty:
+        email_col, name_col, grade_col, _ = find_grade_columns(invalid)
+        for _, row in invalid.iterrows():
+            yield {
+                'status': 'invalid',
+                'moodle_id': '',
+                'name': str(row[name_col]) if name_col and pd.notna(row[name_col]) else '',
+                'email': str(row[email_col]).lower().strip() if email_col and pd.notna(row[email_col]) else '',
+                'current_grade': '',
+                'new_grade': str(row[grade_col]),
+                'feedback': '',
+                'match_type': '',
+                'candidates': '',
+                'issue': row['Issue'],
+            }
+
+REPORT_FIELDS = ['status', 'moodle_id', 'name', 'email', 'current_grade',
+                 'new_grade', 'feedback', 'match_type', 'candidates', 'issue']
+
+REPORT_STYLE = """
+body { font-family: sans-serif; margin: 2em; }
+table { border-collapse: collapse; width: 100%; font-size: 14px; }
+th, td { border: 1px solid #ccc; padding: 4px 8px; text-align: left; }
+th { background: #eee; position: sticky; top: 0; }
+tr.matched { background: #E8F5E9; }
+tr.unchanged { background: #FFFFFF; }
+tr.overwritten { background: #FFE0B2; }
+tr.unmatched { background: #FFCDD2; }
+tr.ambiguous { background: #E1BEE7; }
+tr.invalid { background: #FFF59D; }
+tr.unrouted { background: #CFD8DC; }
+tr.page_failed { background: #EF9A9A; }
+"""
+
+def write_reports(report_dir, rows, title="Grade matching report", fields=REPORT_FIELDS):
+    """Stream report rows to buffered CSV, JSON and HTML files
+
+    Rows are written as they are produced, so memory use does not grow
+    with the size of the course. Returns the status counts and the paths.
+    """
+    os.makedirs(report_dir, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    base = os.path.join(report_dir, f"grade_report_{stamp}")
+    paths = {ext: f"{base}.{ext}" for ext in ('csv', 'json', 'html')}
+    counts = Counter()
+    buffer_size = 1 << 16
+
+    with open(paths['csv'], 'w', newline='', encoding='utf-8', buffering=buffer_size) as csv_file, \
+         open(paths['json'], 'w', encoding='utf-8', buffering=buffer_size) as json_file, \
+         open(paths['html'], 'w', encoding='utf-8', buffering=buffer_size) as html_file:
+
+        writer = csv.DictWriter(csv_file, fieldnames=fields)
+        writer.writeheader()
+
+        json_file.write('{"title": %s, "generated_at": %s, "rows": [\n'
+                        % (json.dumps(title), json.dumps(datetime.now().isoformat(timespec='seconds'))))
+
+        html_file.write(f"<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\">"
+                        f"<title>{html.escape(title)}</title><style>{REPORT_STYLE}</style></head><body>\n"
+                        f"<h1>{html.escape(title)}</h1>\n<table>\n<tr>"
+                        + ''.join(f"<th>{field}</th>" for field in fields) + "</tr>\n")
+
+        for row in rows:
+            writer.writerow(row)
+            if counts:
+                json_file.write(',\n')
+            json_file.write(json.dumps(row, ensure_ascii=False))
+            html_file.write(f'<tr class="{row["status"]}">'
+                            + ''.join(f"<td>{html.escape(str(row[field]))}</td>" for field in fields)
+                            + "</tr>\n")
+            counts[row['status']] += 1
+
+        json_file.write('\n], "summary": %s}\n' % json.dumps(dict(counts)))
+
+        html_file.write("</table>\n<h2>Summary</h2>\n<ul>\n"
+                        + ''.join(f"<li>{html.escape(status)}: {count}</li>\n"
+                                  for status, count in sorted(counts.items()))
+                        + "</ul>\n</body></html>\n")
+
+    return counts, paths
+
+def display_analysis(matched_grades, unmatched, multiple_matches, top=10):
+    """Display aggregate analysis of grade matching and the top problem rows"""
 
     empty_grades = []
     filled_grades = []
@@ -514,79 +1301,64 @@ def display_analysis(matched_grades, unmatched, multiple_matches):
         else:
             empty_grades.append(data)
 
+    changing = [d for d in filled_grades if not grades_equal(d['current_grade'], d['new_grade'])]
+
     print("\n" + "="*70)
     print("📊 GRADE MATCHING ANALYSIS")
     print("="*70)
 
     # Statistics
     print(f"\n📈 STATISTICS:")
-    print(f"  Total in CSV: {len(matched_grades) + len(unmatched)}")
+    print(f"  Total in CSV: {len(matched_grades) + len(unmatched) + len(multiple_matches)}")
     print(f"  Successfully matched: {len(matched_grades)}")
-    email_matches = sum(1 for d in matched_grades.values() if d.get('match_type') == 'email')
-    name_matches = sum(1 for d in matched_grades.values() if d.get('match_type') == 'name')
-    fallback_matches = sum(1 for d in matched_grades.values() if d.get('match_type') == 'fallback')
-
-    if email_matches > 0:
-        print(f"    - By email: {email_matches}")
-    if name_matches > 0:
-        print(f"    - By name: {name_matches}")
-    if fallback_matches > 0:
-        print(f"    - By hardcoded ID: {fallback_matches}")
-    print(f"  Unmatched: {len(unmatched)}")
-    print(f"  Multiple matches: {len(multiple_matches)}")
-
-    # Empty grades (will be filled)
-    if empty_grades:
-        print(f"\n{Fore.GREEN}✓ STUDENTS WITHOUT GRADES (Will be filled):{Style.RESET_ALL}")
+    match_types = Counter(d.get('match_type') for d in matched_grades.values())
+
+    if match_types['email'] > 0:
+        print(f"    - By email: {match_types['email']}")
+    if match_types['name'] > 0:
+        print(f"    - By name: {match_types['name']}")
+    if match_types['fallback'] > 0:
+        print(f"    - By hardcoded ID: {match_types['fallback']}")
+    if match_types['id'] > 0:
+        print(f"    - By Moodle ID: {match_types['id']}")
+    print(f"  {Fore.GREEN}Empty grades to fill: {len(empty_grades)}{Style.RESET_ALL}")
+    print(f"  Existing grades: {len(filled_grades)} "
+          f"({len(filled_grades) - len(changing)} unchanged, {len(changing)} would change)")
+    print(f"  {Fore.RED}Unmatched: {len(unmatched)}{Style.RESET_ALL}")
+    print(f"  {Fore.MAGENTA}Multiple matches: {len(multiple_matches)}{Style.RESET_ALL}")
+
+    # Existing grades that would change (need confirmation)
+    if changing:
+        print(f"\n{Fore.YELLOW}⚠ EXISTING GRADES THAT WOULD CHANGE (first {min(top, len(changing))} of {len(changing)}):{Style.RESET_ALL}")
         print("-" * 50)
-        for student in empty_grades:
-            if student.get('match_type') == 'email':
-                match_type = "📧"
-            elif student.get('match_type') == 'fallback':
-                match_type = "🔗"
-            else:
-                match_type = "👤"
-            print(f"  {match_type} {student['name']} ({student['email']})")
-            print(f"     → Grade: {Fore.GREEN}{student['new_grade']}{Style.RESET_ALL}")
-
-    # Existing grades (need confirmation)
-    if filled_grades:
-        print(f"\n{Fore.YELLOW}⚠ STUDENTS WITH EXISTING GRADES:{Style.RESET_ALL}")
-        print("-" * 50)
-        for student in filled_grades:
-            if student.get('match_type') == 'email':
-                match_type = "📧"
-            elif student.get('match_type') == 'fallback':
-                match_type = "🔗"
-            else:
-                match_type = "👤"
-            print(f"  {match_type} {student['name']} ({student['email']})")
-            print(f"     Current: {Fore.RED}{student['current_grade']}{Style.RESET_ALL}")
-            print(f"     New:     {Fore.GREEN}{student['new_grade']}{Style.RESET_ALL}")
-            if student['current_grade'] != student['new_grade']:
-                print(f"     {Fore.YELLOW}↳ Grade will change!{Style.RESET_ALL}")
+        for student in changing[:top]:
+            print(f"  {match_icon(student.get('match_type'))} {student['name']} ({student['email']}): "
+                  f"{Fore.RED}{student['current_grade']}{Style.RESET_ALL} → "
+                  f"{Fore.GREEN}{student['new_grade']}{Style.RESET_ALL}")
 
     # Unmatched students
     if unmatched:
-        print(f"\n{Fore.RED}✗ UNMATCHED STUDENTS (Cannot be graded):{Style.RESET_ALL}")
+        print(f"\n{Fore.RED}✗ UNMATCHED STUDENTS (first {min(top, len(unmatched))} of {len(unmatched)}):{Style.RESET_ALL}")
         print("-" * 50)
-        for student in unmatched:
+        for student in unmatched[:top]:
             print(f"  • {student['name']} ({student['email']}) - Grade: {student['grade']}")
         print(f"\n  {Fore.YELLOW}Tip: Check if these students are enrolled in the course{Style.RESET_ALL}")
 
     # Multiple matches warning
     if multiple_matches:
-        print(f"\n{Fore.MAGENTA}⚠️  AMBIGUOUS MATCHES (Skipped):{Style.RESET_ALL}")
+        print(f"\n{Fore.MAGENTA}⚠️  AMBIGUOUS MATCHES (first {min(top, len(multiple_matches))} of {len(multiple_matches)}, skipped):{Style.RESET_ALL}")
         print("-" * 50)
-        for item in multiple_matches:
-            print(f"  • {item['csv_name']} ({item['csv_email']}) matches:")
-            for mid, mname, memail in item['matches']:
-                print(f"    → ID: {mid}, {mname} ({memail})")
+        for item in multiple_matches[:top]:
+            print(f"  • {item['csv_name']} ({item['csv_email']}) matches {len(item['matches'])} students")
 
     return empty_grades, filled_grades
 
-def get_user_choice(filled_grades, unmatched):
-    """Get user choice for handling existing grades"""
+def get_user_choice(filled_grades, unmatched, preset=None):
+    """Get user choice for handling existing grades (preset skips the prompt)"""
+
+    if preset:
+        print(f"\n→ Mode from command line: {preset}")
+        return preset
 
     print("\n" + "="*70)
     print("❓ WHAT WOULD YOU LIKE TO DO?")
@@ -638,8 +1410,19 @@ def inject_grades_smart(driver, matched_grades, mode):
 
     var stats = {{filled_new: 0, overwritten: 0, skipped: 0, errors: 0}};
 
+    function selectScaleItem(select, text) {{
+        var wanted = String(text).trim().toLowerCase();
+        for (var i = 0; i < select.options.length; i++) {{
+            if (select.options[i].text.trim().toLowerCase() === wanted) {{
+                select.value = select.options[i].value;
+                return true;
+            }}
+        }}
+        return false;
+    }}
+
     for (var id in grades) {{
-        var gradeInput = document.querySelector('input[name="quickgrade_' + id + '"]');
+        var gradeInput = document.querySelector('[name="quickgrade_' + id + '"]');
         var feedbackTextarea = document.querySelector('textarea[name="quickgrade_comments_' + id + '"]');
 
         if (gradeInput) {{
@@ -650,9 +1433,16 @@ def inject_grades_smart(driver, matched_grades, mode):
                 stats.skipped++;
                 gradeInput.style.backgroundColor = '#FFF9C4'; // Light yellow
                 gradeInput.title = 'Skipped - already has grade';
+            }} else if (gradeInput.tagName === 'SELECT' && !selectScaleItem(gradeInput, grades[id].grade)) {{
+                // Scale item not offered by this select
+                stats.errors++;
+                gradeInput.style.backgroundColor = '#FFCDD2';
+                gradeInput.title = 'Unknown scale item: ' + grades[id].grade;
             }} else {{
                 // Fill the grade
-                gradeInput.value = grades[id].grade;
+                if (gradeInput.tagName !== 'SELECT') {{
+                    gradeInput.value = grades[id].grade;
+                }}
 
                 if (hasExisting) {{
                     gradeInput.style.backgroundColor = '#FFAB91'; // Light orange for overwritten
@@ -675,7 +1465,11 @@ def inject_grades_smart(driver, matched_grades, mode):
     }}
 
     // Highlight save button
-    var saveBtn = document.querySelector('input[value*="Save"], input[name="savechanges"], button[type="submit"]');
+    var saveBtn = null;
+    var saveSelectors = {json.dumps(SAVE_BUTTON_SELECTORS)};
+    for (var s = 0; s < saveSelectors.length && !saveBtn; s++) {{
+        saveBtn = document.querySelector(saveSelectors[s]);
+    }}
     if (saveBtn) {{
         saveBtn.style.backgroundColor = '#4CAF50';
         saveBtn.style.color = 'white';
@@ -688,13 +1482,1103 @@ def inject_grades_smart(driver, matched_grades, mode):
     return stats;
     """
 
-    return driver.execute_script(js_code)
+    with tracer.span('inject'):
+        return driver.execute_script(js_code)
+
+class Tracer:
+    """Debug tracing that costs next to nothing while disabled
+
+    Counts events, keeps the first few examples of each and times phases.
+    Page scripts return their own counts and examples (see merge) instead
+    of writing to the browser console. Call sites check `enabled` before
+    building anything expensive.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.samples = 3
+        self.counts = Counter()
+        self.examples = {}
+        self.timings = {}
+        self.lock = threading.Lock()
+
+    def enable(self, samples=3):
+        self.enabled = True
+        self.samples = samples
+
+    def event(self, name, example=None):
+        """Count an event, keeping the first few examples"""
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counts[name] += 1
+            if example is not None:
+                examples = self.examples.setdefault(name, [])
+                if len(examples) < self.samples:
+                    examples.append(example)
+
+    def merge(self, prefix, trace):
+        """Add the counts and examples returned by a page script"""
+        with self.lock:
+            for name, count in trace.get('counts', {}).items():
+                self.counts[f"{prefix}.{name}"] += count
+            for name, items in trace.get('samples', {}).items():
+                examples = self.examples.setdefault(f"{prefix}.{name}", [])
+                examples.extend(items[:self.samples - len(examples)])
+
+    @contextmanager
+    def span(self, name):
+        """Time a phase"""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                calls, total = self.timings.get(name, (0, 0.0))
+                self.timings[name] = (calls + 1, total + elapsed)
+
+    def report(self):
+        """Print the collected timings, counts and examples"""
+        if not self.enabled:
+            return
+        print("\n" + "="*70)
+        print("🔬 TRACE")
+        print("="*70)
+        for name, (calls, total) in sorted(self.timings.items()):
+            print(f"  ⏱  {name:<24} {calls:>4} x  {total:8.3f}s total  {total / calls:7.3f}s avg")
+        for name, count in sorted(self.counts.items()):
+            print(f"  #  {name:<24} {count:>6}")
+            for example in self.examples.get(name, []):
+                print(f"       e.g. {example}")
+
+# Disabled unless --trace is given
+tracer = Tracer()
+
+class TokenBucket:
+    """Token bucket allowing `rate` requests per second in bursts of up to `capacity`"""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, sleeping until one is available; returns the seconds waited"""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def pause(self, seconds):
+        """Hand out no tokens for the next `seconds`"""
+        with self.lock:
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+class RequestGovernor:
+    """Paces page loads and saves per Moodle host and adapts how many run at once
+
+    Every host gets a token bucket (`rate` requests per second) and a
+    concurrency limit between 1 and `max_concurrency`. The limit grows by
+    one after a run of fast successful requests and is halved when a
+    request fails, is slower than `target_latency` seconds or gets a 429 or
+    5xx response; throttling responses also pause the host's bucket.
+    Thread safe, so parallel workers can share one governor.
+    """
+
+    def __init__(self, rate=2.0, max_concurrency=4, target_latency=10.0):
+        self.rate = rate
+        self.max_concurrency = max_concurrency
+        self.target_latency = target_latency
+        self.hosts = {}
+        self.condition = threading.Condition()
+
+    def configure(self, rate=None, max_concurrency=None):
+        """Change the limits (for hosts seen from now on)"""
+        if rate:
+            self.rate = rate
+        if max_concurrency:
+            self.max_concurrency = max_concurrency
+
+    def host_state(self, host):
+        """Counters for one host; call with the condition held"""
+        if host not in self.hosts:
+            self.hosts[host] = {
+                'bucket': TokenBucket(self.rate, capacity=self.max_concurrency),
+                'limit': float(self.max_concurrency),
+                'in_flight': 0,
+                'queued': 0,
+                'streak': 0,
+                'requests': 0,
+                'latency_total': 0.0,
+                'throttled': 0,
+                'errors': 0,
+                'started': time.monotonic(),
+                'recent': deque(),
+            }
+        return self.hosts[host]
+
+    def limit(self, url):
+        """Current concurrency limit for the host of `url`"""
+        with self.condition:
+            return int(self.host_state(urlparse(url).netloc or url)['limit'])
+
+    def begin(self, url, kind='page', block=True):
+        """Wait for a free slot and a token for the host of `url`; returns a ticket
+
+        With block=False returns None at once if no slot is free.
+        """
+        host = urlparse(url).netloc or url
+        with self.condition:
+            state = self.host_state(host)
+            if not block and state['in_flight'] >= int(state['limit']):
+                return None
+            state['queued'] += 1
+            while state['in_flight'] >= int(state['limit']):
+                self.condition.wait()
+            state['queued'] -= 1
+            state['in_flight'] += 1
+        state['bucket'].acquire()
+        return {'host': host, 'kind': kind, 'start': time.monotonic(), 'status': None}
+
+    def finish(self, ticket, status=None, error=False):
+        """Release the ticket's slot and adapt the host's limit to how the request went"""
+        now = time.monotonic()
+        latency = now - ticket['start']
+        throttled = bool(status) and (status == 429 or status >= 500)
+
+        with self.condition:
+            state = self.hosts[ticket['host']]
+            state['in_flight'] -= 1
+            state['requests'] += 1
+            state['latency_total'] += latency
+            state['recent'].append(now)
+            while state['recent'] and now - state['recent'][0] > 60:
+                state['recent'].popleft()
+
+            if throttled or error or latency > self.target_latency:
+                state['limit'] = max(1.0, state['limit'] / 2)
+                state['streak'] = 0
+                if error:
+                    state['errors'] += 1
+                if throttled:
+                    state['throttled'] += 1
+                    state['bucket'].pause(min(60, 2 ** state['throttled']))
+            else:
+                state['streak'] += 1
+                if state['streak'] >= state['limit']:
+                    state['limit'] = min(float(self.max_concurrency), state['limit'] + 1)
+                    state['streak'] = 0
+
+            self.condition.notify_all()
+
+    @contextmanager
+    def request(self, url, kind='page'):
+        """Context manager around one request; set ticket['status'] to the HTTP status"""
+        ticket = self.begin(url, kind)
+        try:
+            yield ticket
+        except BaseException:
+            self.finish(ticket, ticket['status'], error=True)
+            raise
+        self.finish(ticket, ticket['status'])
+
+    def snapshot(self):
+        """Throughput (requests/s over the last minute), latency, limit and queue depth per host"""
+        now = time.monotonic()
+        with self.condition:
+            result = {}
+            for host, state in self.hosts.items():
+                window = min(60.0, max(now - state['started'], 1.0))
+                result[host] = {
+                    'requests': state['requests'],
+                    'throughput': sum(1 for t in state['recent'] if now - t <= 60) / window,
+                    'avg_latency': state['latency_total'] / state['requests'] if state['requests'] else 0.0,
+                    'limit': int(state['limit']),
+                    'in_flight': state['in_flight'],
+                    'queued': state['queued'],
+                    'throttled': state['throttled'],
+                    'errors': state['errors'],
+                }
+            return result
+
+    def print_status(self):
+        """Print one status line per host"""
+        for host, snap in self.snapshot().items():
+            print(f"  📶 {host}: {snap['requests']} requests, {snap['throughput']:.2f}/s, "
+                  f"avg {snap['avg_latency']:.1f}s, concurrency {snap['in_flight']}/{snap['limit']}, "
+                  f"queued {snap['queued']}, throttled {snap['throttled']}, errors {snap['errors']}")
+
+# Shared by everything that talks to Moodle; configured from the command line
+governor = RequestGovernor()
+
+def navigation_status(driver):
+    """HTTP status of the page currently loaded (None if the browser does not say)"""
+    return driver.execute_script("""
+    var entry = performance.getEntriesByType('navigation')[0];
+    return entry && entry.responseStatus ? entry.responseStatus : null;
+    """)
+
+def check_status(status):
+    """Raise on responses that mean the server is overloaded, so callers back off"""
+    if status and (status == 429 or status >= 500):
+        raise WebDriverException(f"Moodle answered HTTP {status}")
+
+def save_quick_grades(driver, timeout=60):
+    """Click the quick grading save button and wait for Moodle to respond"""
+    buttons = next((found for found in (driver.find_elements(By.CSS_SELECTOR, selector)
+                                         for selector in SAVE_BUTTON_SELECTORS) if found), [])
+    if not buttons:
+        return False
+
+    save_button = buttons[0]
+    with tracer.span('save'), governor.request(driver.current_url, 'save') as ticket:
+        driver.execute_script("arguments[0].click();", save_button)
+        WebDriverWait(driver, timeout).until(EC.staleness_of(save_button))
+        ticket['status'] = navigation_status(driver)
+        check_status(ticket['status'])
+    return True
+
+class SessionExpiredError(Exception):
+    """Moodle sent us to the login page and logging in again did not work"""
+
+def with_retries(action, description, retries=3, base_delay=1.0, max_delay=30.0):
+    """Run action(), retrying browser failures with exponential backoff and full jitter"""
+    for attempt in range(retries + 1):
+        try:
+            return action()
+        except InvalidSessionIdException:
+            # The browser itself is gone, retrying cannot help
+            raise
+        except (WebDriverException, SessionExpiredError) as e:
+            if attempt == retries:
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            reason = (getattr(e, 'msg', None) or str(e) or type(e).__name__).strip().splitlines()[0]
+            tracer.event(f"retry.{description}", reason)
+            print(f"  {Fore.YELLOW}⚠️  {description} failed ({reason}), "
+                  f"retry {attempt + 1}/{retries} in {delay:.1f}s{Style.RESET_ALL}")
+            time.sleep(delay)
+
+def is_login_page(driver, moodle_url):
+    """True if the browser is on Moodle's login page or an external login (SSO) host"""
+    current = urlparse(driver.current_url)
+    if current.netloc and current.netloc != urlparse(moodle_url).netloc:
+        return True
+    if '/login/' in current.path:
+        return True
+    return bool(driver.find_elements(By.CSS_SELECTOR, "form#login, form.login-form"))
+
+def wait_for_page_or_login(driver, moodle_url, timeout=60):
+    """Wait until the grading fields or a login page show up"""
+    WebDriverWait(driver, timeout).until(
+        lambda d: d.find_elements(By.CSS_SELECTOR, GRADE_FIELD_SELECTOR) or is_login_page(d, moodle_url)
+    )
+
+def relogin(driver, moodle_url, interactive=True, timeout=30):
+    """Log in again after the Moodle session expired, using what the profile remembers
+
+    A single sign-on button is followed (the identity provider usually still
+    knows the profile); otherwise a password saved in the profile is submitted.
+    Without a terminal to ask for a manual login, SessionExpiredError is raised.
+    """
+    print(f"  {Fore.YELLOW}🔑 Moodle session expired, logging in again...{Style.RESET_ALL}")
+    sso_buttons = driver.find_elements(By.CSS_SELECTOR, "a.login-identityprovider-btn")
+    login_buttons = driver.find_elements(By.CSS_SELECTOR, "#loginbtn")
+    if sso_buttons:
+        sso_buttons[0].click()
+    elif login_buttons and driver.find_elements(By.CSS_SELECTOR, "#password"):
+        # Chrome fills in a saved password once the page gets a real click
+        login_buttons[0].click()
+
+    try:
+        WebDriverWait(driver, timeout).until(lambda d: not is_login_page(d, moodle_url))
+        return
+    except TimeoutException:
+        pass
+
+    if not interactive:
+        raise SessionExpiredError("could not log in again with the saved profile")
+    input("  Log in to Moodle in the browser window, then press Enter...")
+
+def pending_grades(matched_grades, moodle_students, mode):
+    """Split grades by what the page currently shows
+
+    Returns (to_apply, skipped, unchanged). Grades (and feedback) the page
+    already has are unchanged, so applying the same grades twice - e.g.
+    after a partial save - changes nothing. Feedback is only compared when
+    the page has a feedback field (otherwise it cannot be injected anyway).
+    In skip_existing mode students with another grade are skipped. Current
+    grades are refreshed from the page.
+    """
+    to_apply, skipped, unchanged = {}, {}, {}
+    for student_id, data in matched_grades.items():
+        student = moodle_students.get(student_id, {})
+        data = dict(data, current_grade=student.get('current_grade', data['current_grade']) or '')
+        has_grade = bool(data['current_grade'].strip())
+        current_feedback = student.get('current_feedback')
+        same_feedback = (not data['new_feedback'] or current_feedback is None
+                         or data['new_feedback'].strip() == current_feedback.strip())
+
+        if has_grade and grades_equal(data['current_grade'], data['new_grade']) and same_feedback:
+            unchanged[student_id] = data
+        elif has_grade and mode == 'skip_existing':
+            skipped[student_id] = data
+        else:
+            to_apply[student_id] = data
+    return to_apply, skipped, unchanged
+
+def apply_grades(driver, matched_grades, mode, moodle_url, args):
+    """Inject grades with retries, re-applying only what the page does not have yet
+
+    Returns the injection stats and the grades that were actually applied.
+    """
+    state = {'attempt': 0}
+
+    def attempt():
+        # Start from a clean page on retries, and reopen it when the tab has left
+        # the grading table (e.g. Moodle's confirmation after a manual save)
+        if state['attempt'] or not driver.find_elements(By.CSS_SELECTOR, GRADE_FIELD_SELECTOR):
+            wait_for_grading_table(driver, moodle_url, interactive=not args.yes)
+        state['attempt'] += 1
+
+        students = extract_student_data_from_page(driver)
+        to_apply, skipped, unchanged = pending_grades(matched_grades, students, mode)
+        stats = inject_grades_smart(driver, {**to_apply, **skipped}, mode)
+        stats['unchanged'] = len(unchanged)
+        return stats, to_apply
+
+    return with_retries(attempt, "Injecting grades", args.retries)
+
+def save_verified(driver, moodle_url, applied, args):
+    """Save, reopen the grading page and re-apply grades that did not stick
+
+    Returns the students on the reloaded page and the grades still missing.
+    """
+    for round_number in range(args.retries + 1):
+        saved = with_retries(lambda: save_quick_grades(driver), "Saving grades", args.retries)
+        if not saved:
+            print(f"{Fore.RED}❌ Could not find the save button{Style.RESET_ALL}")
+
+        # Moodle shows a confirmation page after saving
+        with_retries(lambda: wait_for_grading_table(driver, moodle_url, interactive=not args.yes),
+                     "Reloading the grading page", args.retries)
+        students = extract_students(driver)
+        missing, _, _ = pending_grades(applied, students, 'overwrite')
+
+        if not missing:
+            print(f"{Fore.GREEN}✓ Grades saved and verified ({len(applied)} students){Style.RESET_ALL}")
+            return students, missing
+        if not saved or round_number == args.retries:
+            break
+
+        print(f"  {Fore.YELLOW}⚠️  {len(missing)} grades did not stick, applying them again...{Style.RESET_ALL}")
+        inject_grades_smart(driver, missing, 'overwrite')
+
+    print(f"{Fore.RED}❌ {len(missing)} grades are not saved in Moodle:{Style.RESET_ALL}")
+    for data in list(missing.values())[:args.top]:
+        print(f"  • {data['name']} ({data['email']}): expected {data['new_grade']}, "
+              f"page shows {data['current_grade'] or '-'}")
+    return students, missing
+
+def extract_students(driver):
+    """Extract the page's students, falling back to bare grade fields"""
+    moodle_students = extract_student_data_from_page(driver)
+    print(f"✓ Found {len(moodle_students)} students on Moodle page")
+
+    # If no students found, try simpler extraction
+    if len(moodle_students) == 0:
+        print("⚠️  No students found with email extraction, trying name-only extraction...")
+        js_simple = """
+        var students = {};
+        var inputs = Array.prototype.filter.call(
+            document.querySelectorAll('input[name^="quickgrade_"], select[name^="quickgrade_"]'),
+            function (field) { return /^quickgrade_\\d+$/.test(field.name); }
+        );
+        for (var i = 0; i < inputs.length; i++) {
+            var input = inputs[i];
+            var id = input.name.replace('quickgrade_', '');
+
+            // Scales show the selected item, -1 is "No grade"
+            var currentGrade = '';
+            if (input.tagName === 'SELECT') {
+                if (input.value !== '-1' && input.selectedIndex >= 0) {
+                    currentGrade = input.options[input.selectedIndex].text.trim();
+                }
+            } else {
+                currentGrade = input.value || '';
+            }
+
+            students[id] = {
+                id: id,
+                email: '',
+                name: 'Student_' + id,
+                current_grade: currentGrade,
+                field_exists: true
+            };
+        }
+        return students;
+        """
+        moodle_students = driver.execute_script(js_simple)
+        print(f"✓ Found {len(moodle_students)} grade input fields")
+
+        if len(moodle_students) > 0:
+            print("\n⚠️  NOTE: Could not extract emails from page.")
+            print("   Will use the hardcoded ID mappings instead.")
+
+    return moodle_students
+
+def prepare_page(driver, df, moodle_url, args):
+    """Extract, validate and match the grades for the grading page open in the driver"""
+    print("\n🔍 Extracting student data from Moodle...")
+    moodle_students = with_retries(lambda: extract_students(driver), "Extracting students", args.retries)
+
+    # Validate and normalize all grades before anything is injected
+    scale = resolve_grade_scale(driver, moodle_url, args.max_grade, args.scale)
+    with tracer.span('validate'):
+        df, invalid_grades, converted = validate_grades(df, scale)
+    display_validation(scale, invalid_grades, converted, top=args.top)
+
+    # Map CSV grades to Moodle students
+    with tracer.span('match'):
+        matched_grades, unmatched, multiple_matches = map_grades_to_students(df, moodle_students, verbose=args.verbose)
+
+    return {
+        'url': moodle_url,
+        'students': moodle_students,
+        'scale': scale,
+        'matched': matched_grades,
+        'unmatched': unmatched,
+        'ambiguous': multiple_matches,
+        'invalid': invalid_grades,
+    }
+
+def print_injection_stats(stats, headless=False):
+    """Display the injection results"""
+    print("\n" + "="*70)
+    print("✅ INJECTION COMPLETE!")
+    print("="*70)
+    if stats['filled_new'] > 0:
+        print(f"  {Fore.GREEN}✓ New grades filled: {stats['filled_new']}{Style.RESET_ALL}")
+    if stats['overwritten'] > 0:
+        print(f"  {Fore.YELLOW}✓ Grades overwritten: {stats['overwritten']}{Style.RESET_ALL}")
+    if stats['skipped'] > 0:
+        print(f"  {Fore.CYAN}○ Grades skipped: {stats['skipped']}{Style.RESET_ALL}")
+    if stats.get('unchanged', 0) > 0:
+        print(f"  ○ Already up to date: {stats['unchanged']}")
+    if stats['errors'] > 0:
+        print(f"  {Fore.RED}✗ Errors: {stats['errors']}{Style.RESET_ALL}")
+
+    if not headless:
+        print("\n📌 COLOR GUIDE:")
+        print(f"  {Fore.GREEN}Green fields{Style.RESET_ALL} = New grades added")
+        print(f"  {Fore.YELLOW}Orange fields{Style.RESET_ALL} = Existing grades overwritten")
+        print(f"  {Fore.CYAN}Yellow fields{Style.RESET_ALL} = Skipped (already had grades)")
 
-def setup_chrome_driver(profile_name=None, custom_path=None):
-    """Setup Chrome driver with selected profile"""
+def finish_save(targets, args, headless=False):
+    """Save the injected grades in every given tab, or tell the user to
+
+    targets holds (driver, window handle, grading URL, applied grades, stats)
+    per tab. Tabs of different browsers are saved side by side. Returns
+    (grading URL, save status, grades saved, stats) per tab.
+    """
+    if headless or args.auto_save:
+        # Nobody can click the button in a headless browser
+        if not args.auto_save:
+            confirm = input("\nSave these grades in Moodle now? (yes/no): ").strip().lower()
+            if confirm != 'yes':
+                print("Changes discarded (not saved)")
+                return [(moodle_url, 'discarded', {}, stats) for _, _, moodle_url, _, stats in targets]
+
+        def save_tabs(tabs):
+            results = []
+            for driver, handle, moodle_url, applied, stats in tabs:
+                driver.switch_to.window(handle)
+                _, missing = save_verified(driver, moodle_url, applied, args)
+                saved = {sid: data for sid, data in applied.items() if sid not in missing}
+                results.append((moodle_url, 'partially saved' if missing else 'saved', saved, stats))
+            return results
+
+        browsers = {}
+        for target in targets:
+            browsers.setdefault(id(target[0]), []).append(target)
+        with ThreadPoolExecutor(max_workers=len(browsers)) as pool:
+            return [result for results in pool.map(save_tabs, browsers.values()) for result in results]
+
+    print("\n" + "="*70)
+    print("📌 NEXT STEPS:")
+    print("="*70)
+    print("1. Review the colored grade fields" + (f" in each of the {len(targets)} tabs" if len(targets) > 1 else ""))
+    print("2. Click the green 'Save all quick grading changes' button")
+    print("3. Wait for Moodle to confirm the save")
+
+    input("\nPress Enter after you've saved the grades...")
+    return [(moodle_url, 'saved manually', applied, stats) for _, _, moodle_url, applied, stats in targets]
+
+def save_and_reload(driver, moodle_url, page, applied, args):
+    """Save the quick grading changes, reopen the grading page and refresh its students
+
+    Returns the grades that were saved.
+    """
+    page['students'], missing = save_verified(driver, moodle_url, applied, args)
+    return {sid: data for sid, data in applied.items() if sid not in missing}
+
+def watched_files(input_file):
+    """Files whose changes trigger a reload: the grades file, plus pipeline sources"""
+    files = [input_file]
+    if input_file.endswith('.json'):
+        try:
+            with open(input_file, 'r') as f:
+                spec = json.load(f)
+        except Exception:
+            return files
+        base_dir = os.path.dirname(os.path.abspath(input_file))
+        inputs = [source['file'] for source in spec.get('sources', [])]
+        if spec.get('late'):
+            inputs.append(spec['late']['file'])
+        for path in inputs:
+            path = path if os.path.isabs(path) else os.path.join(base_dir, path)
+            if path not in files:
+                files.append(path)
+    return files
+
+def files_signature(files):
+    """Modification time and size of each file (None while a file is missing)"""
+    signature = []
+    for path in files:
+        try:
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+def wait_for_change(files, signature, debounce=2.0, poll=0.5):
+    """Block until the files change and then stay unchanged for `debounce` seconds"""
+    while True:
+        time.sleep(poll)
+        current = files_signature(files)
+        if current == signature:
+            continue
+
+        # Editors often write a file in several steps; wait for it to settle
+        stable_since = time.monotonic()
+        while time.monotonic() - stable_since < debounce:
+            time.sleep(poll)
+            latest = files_signature(files)
+            if latest != current:
+                current = latest
+                stable_since = time.monotonic()
+        if None not in current:
+            return current
+
+def changed_rows(old_df, new_df):
+    """Rows of new_df that are new or whose grade or feedback differ from old_df
+
+    Grades are compared as grades (see grades_equal), so a column that pandas
+    reads as float after a blank cell appears ("1" → "1.0") is not a change.
+    """
+    email_col, name_col, grade_col, feedback_col = find_grade_columns(new_df)
+    key_col = email_col or name_col
+    if key_col is None or grade_col is None:
+        return new_df
+
+    def column_by_key(df, col):
+        if key_col not in df.columns:
+            return pd.Series(dtype=object)
+        keys = df[key_col].astype(str).str.lower().str.strip().to_numpy()
+        if not col or col not in df.columns:
+            return pd.Series('', index=keys, dtype=object)
+        return pd.Series(df[col].fillna('').astype(str).to_numpy(), index=keys)
+
+    def latest(series):
+        return series[~series.index.duplicated(keep='last')]
+
+    old_grades = latest(column_by_key(old_df, grade_col))
+    old_feedback = latest(column_by_key(old_df, feedback_col))
+    new_grades = column_by_key(new_df, grade_col)
+    new_feedback = column_by_key(new_df, feedback_col)
+
+    changed = [
+        key not in old_grades.index
+        or not grades_equal(old_grades[key], grade)
+        or (feedback_col is not None and old_feedback.get(key, '') != feedback)
+        for key, grade, feedback in zip(new_grades.index, new_grades.to_numpy(), new_feedback.to_numpy())
+    ]
+    return new_df[changed]
+
+def push_changes(driver, changed_df, page, args, unsaved=None):
+    """Validate, match and inject only the changed rows (always overwriting)
+
+    unsaved holds grades injected in earlier cycles and not saved yet; they
+    are applied again too, so a reload of the page does not lose them
+    (grades the page still shows are left alone). Returns the injection
+    stats and the applied grades, or None.
+    """
+    valid, invalid, _ = validate_grades(changed_df, page['scale'])
+    if not invalid.empty:
+        display_validation(page['scale'], invalid, 0, top=args.top)
+
+    matched_grades, unmatched, multiple_matches = map_grades_to_students(valid, page['students'], verbose=args.verbose)
+    for item in unmatched[:args.top]:
+        print(f"  ❌ No match found: {item['name']} ({item['email']})")
+
+    if not matched_grades:
+        return None
+
+    for data in list(matched_grades.values())[:args.top]:
+        print(f"  ✏️  {data['name']} ({data['email']}): {data['current_grade'] or '-'} → {data['new_grade']}")
+    if len(matched_grades) > args.top:
+        print(f"     ... and {len(matched_grades) - args.top} more")
+
+    return apply_grades(driver, {**(unsaved or {}), **matched_grades}, 'overwrite', page['url'], args)
+
+def watch_grades_file(driver, input_file, df, page, args, history=None, unsaved=None):
+    """Keep the session open and push grade changes whenever the grades file is saved
+
+    Without --auto-save, every grade injected so far (unsaved) is kept and
+    pushed again with each change, since the page may be reloaded before
+    the user saves.
+    """
+    unsaved = dict(unsaved or {})
+    files = watched_files(input_file)
+    signature = files_signature(files)
+
+    print("\n" + "="*70)
+    print(f"👀 WATCHING {', '.join(os.path.basename(f) for f in files)}")
+    print("="*70)
+    if args.auto_save:
+        print("  Changed grades are injected and saved automatically")
+    else:
+        print("  Changed grades are injected; save them in Moodle before stopping")
+    print("  Press Ctrl+C to stop")
+
+    while True:
+        signature = wait_for_change(files, signature, debounce=args.debounce)
+        print(f"\n🔄 [{datetime.now():%H:%M:%S}] {os.path.basename(input_file)} changed, reloading...")
+
+        try:
+            new_df = load_input(input_file)
+        except SystemExit:
+            # Half-written or broken file: keep the old grades and wait for the next save
+            print(f"  {Fore.YELLOW}⚠️  Could not read the file, waiting for the next change{Style.RESET_ALL}")
+            continue
+
+        changed = changed_rows(df, new_df)
+        df = new_df
+        files = watched_files(input_file)
+        signature = files_signature(files)
+
+        if changed.empty:
+            print("  No grade changes")
+            continue
+
+        print(f"  {len(changed)} changed rows")
+        result = push_changes(driver, changed, page, args, unsaved)
+        if result is None:
+            print("  Nothing to inject")
+            continue
+        stats, applied = result
+        status = 'injected, not saved'
+
+        print(f"  {Fore.GREEN}✓ Injected: {stats['filled_new'] + stats['overwritten']}{Style.RESET_ALL}"
+              + (f", {Fore.RED}errors: {stats['errors']}{Style.RESET_ALL}" if stats['errors'] else ""))
+
+        if args.auto_save:
+            applied = save_and_reload(driver, page['url'], page, applied, args)
+            status = 'saved'
+        else:
+            unsaved.update(applied)
+        record_history(history, [(page['url'], status, applied, stats)], 'watch', input_file)
+        governor.print_status()
+
+class GradeHistory:
+    """Append-only SQLite log of every run and every grade it changed
+
+    Changes are indexed by student (email and Moodle id) and assignment,
+    so audit queries and rollbacks never need Moodle. Runs that were not
+    saved in Moodle (e.g. watch mode without --auto-save) are kept for the
+    record, but their grades are not treated as changes.
+    """
+
+    SAVED_STATUSES = ('saved', 'partially saved', 'saved manually')
+
+    SCHEMA = """
+    PRAGMA journal_mode = WAL;
+    PRAGMA synchronous = NORMAL;
+    CREATE TABLE IF NOT EXISTS runs (
+        id INTEGER PRIMARY KEY,
+        started_at TEXT NOT NULL,
+        assignment TEXT NOT NULL,
+        url TEXT NOT NULL,
+        mode TEXT NOT NULL,
+        source_file TEXT,
+        status TEXT,
+        stats TEXT
+    );
+    CREATE TABLE IF NOT EXISTS changes (
+        id INTEGER PRIMARY KEY,
+        run_id INTEGER NOT NULL REFERENCES runs(id),
+        assignment TEXT NOT NULL,
+        student_id TEXT NOT NULL,
+        email TEXT,
+        old_grade TEXT,
+        new_grade TEXT,
+        feedback_hash TEXT,
+        mode TEXT NOT NULL,
+        ts TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS changes_email ON changes (email, assignment, ts);
+    CREATE INDEX IF NOT EXISTS changes_student ON changes (student_id, assignment, ts);
+    CREATE INDEX IF NOT EXISTS changes_assignment ON changes (assignment, ts);
+    CREATE INDEX IF NOT EXISTS changes_run ON changes (run_id);
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(self.SCHEMA)
+
+    def record_run(self, moodle_url, mode, source_file, applied, status='', stats=None):
+        """Store one run and the grades it applied; returns the run id"""
+        now = datetime.now().isoformat(timespec='seconds')
+        assignment = assignment_key(moodle_url)
+        rows = [
+            (assignment, student_id, data.get('email') or '', data.get('current_grade') or '',
+             data['new_grade'], feedback_hash(data.get('new_feedback')), mode, now)
+            for student_id, data in applied.items()
+        ]
+        with self.lock, self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO runs (started_at, assignment, url, mode, source_file, status, stats) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (now, assignment, moodle_url, mode, source_file, status, json.dumps(stats or {}))
+            )
+            run_id = cursor.lastrowid
+            self.conn.executemany(
+                "INSERT INTO changes (run_id, assignment, student_id, email, old_grade, new_grade, "
+                "feedback_hash, mode, ts) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(run_id,) + row for row in rows]
+            )
+        return run_id
+
+    def student_changes(self, student, since=None, assignment=None):
+        """Changes for one student (email or Moodle id), newest first"""
+        column = 'email' if '@' in student else 'student_id'
+        query = (f"SELECT changes.* FROM changes JOIN runs ON runs.id = changes.run_id "
+                 f"WHERE changes.{column} = ? AND runs.status IN ({', '.join('?' * len(self.SAVED_STATUSES))})")
+        params = [student.lower().strip() if column == 'email' else student, *self.SAVED_STATUSES]
+        if assignment:
+            query += " AND changes.assignment = ?"
+            params.append(assignment)
+        if since:
+            query += " AND changes.ts >= ?"
+            params.append(since)
+        with self.lock:
+            return self.conn.execute(query + " ORDER BY changes.ts DESC, changes.id DESC", params).fetchall()
+
+    def recent_runs(self, limit=20):
+        """The latest runs with their number of changes"""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT runs.*, (SELECT COUNT(*) FROM changes WHERE changes.run_id = runs.id) AS changes "
+                "FROM runs ORDER BY id DESC LIMIT ?", (limit,)
+            ).fetchall()
+
+    def run(self, run_id):
+        """One run, or None"""
+        with self.lock:
+            return self.conn.execute("SELECT * FROM runs WHERE id = ?", (run_id,)).fetchone()
+
+    def run_changes(self, run_id):
+        """All grade changes made by one run"""
+        with self.lock:
+            return self.conn.execute("SELECT * FROM changes WHERE run_id = ? ORDER BY id", (run_id,)).fetchall()
+
+def feedback_hash(feedback):
+    """Short hash of a feedback text, so the history shows when feedback changed"""
+    if not feedback:
+        return ''
+    return hashlib.sha256(feedback.encode('utf-8')).hexdigest()[:16]
+
+def record_history(history, results, mode, input_file):
+    """Store finished runs (see finish_save) in the grade history"""
+    if history is None:
+        return
+    for moodle_url, status, saved, stats in results:
+        if status == 'discarded':
+            continue
+        run_id = history.record_run(moodle_url, mode, os.path.abspath(input_file), saved, status, stats)
+        print(f"🗂  History: run {run_id} recorded ({len(saved)} changes, {status})")
+
+def run_history_query(args):
+    """Answer --history-student, --history-runs and --rollback from the history; True if one ran"""
+    if not (args.history_student or args.history_runs or args.rollback):
+        return False
+    if not os.path.exists(args.history):
+        print(f"❌ No grade history at {args.history}")
+        sys.exit(1)
+
+    history = GradeHistory(args.history)
+    start = time.perf_counter()
+
+    if args.history_student:
+        rows = history.student_changes(args.history_student, since=args.since)
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"\n🗂  {len(rows)} changes for {args.history_student} ({elapsed:.1f} ms)")
+        for row in rows:
+            feedback = f", feedback {row['feedback_hash']}" if row['feedback_hash'] else ""
+            print(f"  {row['ts']}  run {row['run_id']:<5} {row['assignment']:<40} "
+                  f"{row['old_grade'] or '-'} → {row['new_grade']} ({row['mode']}{feedback})")
+
+    if args.history_runs:
+        rows = history.recent_runs()
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"\n🗂  Latest runs ({elapsed:.1f} ms)")
+        for row in rows:
+            print(f"  run {row['id']:<5} {row['started_at']}  {row['assignment']:<40} "
+                  f"{row['changes']:>5} changes  {row['mode']}, {row['status']}")
+
+    if args.rollback:
+        run = history.run(args.rollback)
+        if run is None:
+            print(f"❌ No run {args.rollback} in the history")
+            sys.exit(1)
+        if run['status'] not in GradeHistory.SAVED_STATUSES:
+            print(f"❌ Run {args.rollback} was not saved in Moodle ({run['status']}); nothing to roll back")
+            sys.exit(1)
+        rows = history.run_changes(args.rollback)
+        output = f"rollback_run_{args.rollback}.csv"
+        with open(output, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            # Moodle ID matches students whose page showed no email
+            writer.writerow(['Moodle ID', 'Email address', 'Grade'])
+            for row in rows:
+                writer.writerow([row['student_id'], row['email'], row['old_grade']])
+        elapsed = (time.perf_counter() - start) * 1000
+        cleared = sum(1 for row in rows if not row['old_grade'])
+        print(f"\n↩️  Rollback of run {run['id']} ({run['started_at']}, {run['assignment']}): "
+              f"{len(rows)} grades written to {output} ({elapsed:.1f} ms)")
+        if cleared:
+            print(f"   {cleared} students had no grade before; clear those in Moodle by hand")
+        no_email = sum(1 for row in rows if not row['email'])
+        if no_email:
+            print(f"   {no_email} students were recorded without an email; they are matched by Moodle ID")
+        print(f"   Apply it with: python {os.path.basename(sys.argv[0])} {output} \"{run['url']}\" --mode overwrite")
+
+    return True
+
+def load_shard_map(shard_map_file):
+    """Load the group → grading page URL map used by sharding mode"""
+    try:
+        with open(shard_map_file, 'r') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"❌ Error loading shard map: {e}")
+        sys.exit(1)
+
+def split_shards(df, column, shard_map):
+    """Partition the grades by a column into one DataFrame per mapped value
+
+    A cell may list several groups separated by commas; the row then goes
+    to every mapped group it lists. Returns the shards and the rows that
+    have no mapped group.
+    """
+    if column not in df.columns:
+        print(f"❌ Error: no '{column}' column to shard by")
+        sys.exit(1)
+
+    keys = df[column].astype(str).str.split(',').explode().str.strip()
+    routed = keys[keys.isin(shard_map.keys())]
+
+    shards = {}
+    for key, index in routed.groupby(routed).groups.items():
+        shards[key] = df.loc[index.unique()]
+
+    unrouted = df[~df.index.isin(routed.index)].copy()
+    unrouted['Issue'] = "no page for " + column + " '" + unrouted[column].fillna('').astype(str) + "'"
+    return shards, unrouted
+
+def open_shard_tabs(driver, urls):
+    """Open every URL in its own tab without waiting, so the pages load concurrently"""
+    handles = {}
+    for key, url in urls.items():
+        before = set(driver.window_handles)
+        driver.execute_script("window.open(arguments[0], '_blank');", url)
+        handles[key] = next(h for h in driver.window_handles if h not in before)
+    return handles
+
+def load_shard_tabs(driver, keys, shard_map):
+    """Open the given shards as tabs of one browser, in waves the governor allows
+
+    Returns the window handle of each shard and whether its page loaded logged in.
+    """
+    handles = {}
+    ready = {}
+    remaining = list(keys)
+    while remaining:
+        # Open as many tabs at once as the governor allows, and release every
+        # slot once the tabs have loaded, before anything else is requested.
+        # Only the first slot is waited for, so browsers sharing a host never
+        # hold slots while waiting for more.
+        tickets = {}
+        for key in remaining[:governor.limit(shard_map[remaining[0]])]:
+            ticket = governor.begin(shard_map[key], 'page', block=not tickets)
+            if ticket is None:
+                break
+            tickets[key] = ticket
+            handles.update(open_shard_tabs(driver, {key: shard_map[key]}))
+        wave = list(tickets)
+        remaining = remaining[len(wave):]
+        for key in wave:
+            driver.switch_to.window(handles[key])
+            try:
+                wait_for_page_or_login(driver, shard_map[key])
+                status = navigation_status(driver)
+                ready[key] = not is_login_page(driver, shard_map[key]) and not (status and status >= 400)
+                governor.finish(tickets[key], status)
+            except WebDriverException:
+                ready[key] = False
+                governor.finish(tickets[key], error=True)
+    return handles, ready
+
+def run_shards(drivers, df, input_file, args, headless=False, history=None, profile=(None, None)):
+    """Route one master sheet to several grading pages by group and process them together
+
+    Shards are dealt out to the given browsers, which load and save their
+    pages side by side; matching and the user's choice cover all of them.
+    """
+    shard_map = load_shard_map(args.shard_map)
+    shards, unrouted = split_shards(df, args.shard_by, shard_map)
+
+    print(f"\n🧩 Sharding by '{args.shard_by}': {len(shards)} pages, "
+          f"{len(unrouted)} rows without a mapped {args.shard_by}"
+          + (f", {len(drivers)} browsers" if len(drivers) > 1 else ""))
+    if not shards:
+        print(f"{Fore.RED}❌ No rows match the shard map{Style.RESET_ALL}")
+        return
+
+    start = time.perf_counter()
+    keys = list(shards)
+    assigned = [keys[i::len(drivers)] for i in range(len(drivers))]
+    with ThreadPoolExecutor(max_workers=len(drivers)) as pool:
+        loaded = list(pool.map(lambda driver, part: load_shard_tabs(driver, part, shard_map), drivers, assigned))
+    handles, ready, owner = {}, {}, {}
+    for driver, (tabs, loaded_ok) in zip(drivers, loaded):
+        handles.update(tabs)
+        ready.update(loaded_ok)
+        owner.update({key: driver for key in tabs})
+
+    pages = {}
+    failed = {}
+    for key, shard_df in shards.items():
+        driver = owner[key]
+        driver.switch_to.window(handles[key])
+        print("\n" + "="*70)
+        print(f"📄 {key}: {len(shard_df)} rows → {shard_map[key]}")
+        try:
+            if not ready[key]:
+                # Reload with retries, logging in again if needed
+                with_retries(lambda: wait_for_grading_table(driver, shard_map[key], interactive=not args.yes),
+                             f"Loading {key}", args.retries)
+        except (WebDriverException, SessionExpiredError):
+            print(f"  {Fore.RED}❌ Could not find the grading table, skipping {key}{Style.RESET_ALL}")
+            failed[key] = shard_df.assign(Issue=f"grading page did not load: {shard_map[key]}")
+            continue
+        print(f"  ✓ Page ready after {time.perf_counter() - start:.2f}s")
+        pages[key] = prepare_page(driver, shard_df, shard_map[key], args)
+
+    if pages:
+        mark_login(*profile, shard_map[next(iter(pages))])
+
+    # One combined analysis; ids are prefixed since a student may be on several pages
+    matched_grades = {f"{key}:{sid}": data for key, page in pages.items() for sid, data in page['matched'].items()}
+    unmatched = [item for page in pages.values() for item in page['unmatched']]
+    multiple_matches = [item for page in pages.values() for item in page['ambiguous']]
+    empty_grades, filled_grades = display_analysis(matched_grades, unmatched, multiple_matches, top=args.top)
+
+    def report_rows():
+        for key, page in pages.items():
+            for row in iter_report_rows(page['matched'], page['unmatched'], page['ambiguous'], page['invalid']):
+                row['shard'] = key
+                yield row
+        for key, rows in failed.items():
+            for row in iter_report_rows({}, [], [], rows):
+                row['status'] = 'page_failed'
+                row['shard'] = key
+                yield row
+        for row in iter_report_rows({}, [], [], unrouted):
+            row['status'] = 'unrouted'
+            row['shard'] = ''
+            yield row
+
+    counts, report_paths = write_reports(
+        args.report_dir, report_rows(),
+        title=f"Grade matching report: {os.path.basename(input_file)} by {args.shard_by}",
+        fields=['shard'] + REPORT_FIELDS
+    )
+    print(f"\n📄 Full report ({sum(counts.values())} rows): {report_paths['html']}")
+    print(f"   Also as CSV/JSON: {report_paths['csv']}, {report_paths['json']}")
+    if failed:
+        print(f"{Fore.RED}❌ {counts['page_failed']} rows not graded: the pages of {', '.join(failed)} did not load "
+              f"(status page_failed in the report){Style.RESET_ALL}")
+    failed_results = [(shard_map[key], 'page failed', {}, {}) for key in failed]
+
+    if not matched_grades:
+        print(f"\n{Fore.RED}❌ No students could be matched! Check your CSV file.{Style.RESET_ALL}")
+        record_history(history, failed_results, args.mode or 'none', input_file)
+        return
+
+    choice = get_user_choice(filled_grades, unmatched, args.mode)
+    if choice == 'cancel':
+        print("\n❌ Operation cancelled by user")
+        return
+
+    print(f"\n💉 Injecting grades (mode: {choice})...")
+    total = Counter({'filled_new': 0, 'overwritten': 0, 'skipped': 0, 'errors': 0, 'unchanged': 0})
+    targets = []
+    for key, page in pages.items():
+        driver = owner[key]
+        driver.switch_to.window(handles[key])
+        stats, applied = apply_grades(driver, page['matched'], choice, shard_map[key], args)
+        print(f"  {key}: {stats['filled_new']} new, {stats['overwritten']} overwritten, "
+              f"{stats['skipped']} skipped, {stats['unchanged']} up to date, {stats['errors']} errors")
+        total.update(stats)
+        targets.append((driver, handles[key], shard_map[key], applied, stats))
+
+    print_injection_stats(total, headless)
+    results = finish_save(targets, args, headless)
+    record_history(history, results + failed_results, choice, input_file)
+    governor.print_status()
+
+def setup_chrome_driver(profile_name=None, custom_path=None, fast=False, headless=None):
+    """Setup Chrome driver with selected profile
+
+    With fast=True Chrome runs headless with the eager page load strategy,
+    and with images, fonts, media and known third-party hosts blocked.
+    Headless is the default for saved profiles; pass headless to override.
+    With both custom_path and profile_name, profile_name is a profile
+    inside the custom user data dir (see clone_profile).
+    """
+    if headless is None:
+        headless = bool(profile_name or custom_path)
 
     options = webdriver.ChromeOptions()
-    options.add_argument('--start-maximized')
     options.add_experimental_option('excludeSwitches', ['enable-logging', 'enable-automation'])
     options.add_experimental_option('useAutomationExtension', False)
 
@@ -703,150 +2587,387 @@ def setup_chrome_driver(profile_name=None, custom_path=None):
     options.add_argument('--disable-dev-shm-usage')
     options.add_argument('--no-sandbox')
 
-    # Enable browser console logging
-    options.set_capability('goog:loggingPrefs', {'browser': 'ALL'})
+    if fast:
+        # A temporary profile needs a visible window to log in
+        if headless:
+            options.add_argument('--headless=new')
+            options.add_argument('--window-size=1920,1080')
+        else:
+            options.add_argument('--start-maximized')
+            print("   ⚠️  Temporary profile: running with a visible window so you can log in")
+        options.page_load_strategy = 'eager'
+        options.add_argument('--blink-settings=imagesEnabled=false')
+        options.add_experimental_option('prefs', {
+            'profile.managed_default_content_settings.images': 2,
+            'profile.managed_default_content_settings.media_stream': 2,
+        })
+    else:
+        options.add_argument('--start-maximized')
 
     if custom_path:
         options.add_argument(f"--user-data-dir={custom_path}")
+        if profile_name:
+            options.add_argument(f"--profile-directory={profile_name}")
         print(f"   Using custom profile path: {custom_path}")
     elif profile_name:
-        system = platform.system()
-        if system == "Linux":
-            base_path = os.path.expanduser("~/.config/google-chrome")
-        elif system == "Windows":
-            base_path = os.path.expandvars(r"%LOCALAPPDATA%\Google\Chrome\User Data")
-        elif system == "Darwin":
-            base_path = os.path.expanduser("~/Library/Application Support/Google/Chrome")
-
-        options.add_argument(f"--user-data-dir={base_path}")
+        options.add_argument(f"--user-data-dir={chrome_user_data_dir()}")
         options.add_argument(f"--profile-directory={profile_name}")
         print(f"   Using Chrome profile: {profile_name}")
         print("   ⚠️  Make sure Chrome is closed if using this profile!")
     else:
         # Temporary profile
-        temp_profile = os.path.expanduser("~/.moodle_temp_profile")
-        options.add_argument(f"--user-data-dir={temp_profile}")
+        options.add_argument(f"--user-data-dir={TEMP_PROFILE}")
         print("   Using temporary profile")
 
     # Auto-download and setup ChromeDriver
     print("   Setting up ChromeDriver (auto-downloading if needed)...")
     service = Service(ChromeDriverManager().install())
 
-    return webdriver.Chrome(service=service, options=options)
+    driver = webdriver.Chrome(service=service, options=options)
 
-def main():
-    # Parse arguments
-    if len(sys.argv) < 2:
-        print("Usage: python smart_grade_injector_v4_final.py <grades.csv/xlsx> [moodle_url]")
-        print("\nCSV should have columns: Email, Student Name, Grade, Feedback")
-        print("Email is used as the primary unique identifier")
-        sys.exit(1)
+    if fast:
+        # Block requests before they leave the browser
+        try:
+            driver.execute_cdp_cmd('Network.enable', {})
+            driver.execute_cdp_cmd('Network.setBlockedURLs', {
+                'urls': BLOCKED_RESOURCE_PATTERNS + BLOCKED_THIRD_PARTY_HOSTS
+            })
+        except Exception as e:
+            print(f"   ⚠️  Could not enable request blocking: {e}")
+
+    return driver
+
+def cookies_mtime(profile_dir):
+    """When the profile's cookie store last changed (0 if it has none)"""
+    paths = [os.path.join(profile_dir, 'Network', 'Cookies'), os.path.join(profile_dir, 'Cookies')]
+    return max((os.path.getmtime(p) for p in paths if os.path.exists(p)), default=0)
+
+def clone_profile(profile_name, custom_path, worker):
+    """Copy a profile into a user data dir of its own for one worker
+
+    Chrome locks a user data dir to a single browser, so parallel sessions
+    (and sessions next to a running Chrome) each use a copy. A copy is only
+    refreshed when the original has newer cookies, e.g. after logging in
+    there again; a copy that logged in by itself is kept as it is.
+    Returns (profile_name, user_data_dir) for setup_chrome_driver.
+    """
+    source_root = custom_path or (chrome_user_data_dir() if profile_name else TEMP_PROFILE)
+    label = "".join(c if c.isalnum() or c in '.-' else '_' for c in profile_key(profile_name, custom_path))
+    clone_root = os.path.join(WORKER_PROFILES_DIR, label.strip('_'), f"worker-{worker}")
+    source = os.path.join(source_root, profile_name or 'Default')
+    target = os.path.join(clone_root, profile_name or 'Default')
+
+    if os.path.exists(source) and cookies_mtime(source) > cookies_mtime(target):
+        print(f"   Copying profile for worker {worker}...")
+        try:
+            shutil.copytree(source, target, ignore=shutil.ignore_patterns(*CLONE_IGNORE), dirs_exist_ok=True)
+            # Holds the key that decrypts cookies and saved passwords on Windows
+            local_state = os.path.join(source_root, 'Local State')
+            if os.path.exists(local_state):
+                shutil.copy2(local_state, clone_root)
+        except (shutil.Error, OSError) as e:
+            print(f"   ⚠️  Some profile files could not be copied (worker {worker}): {str(e)[:100]}")
+    os.makedirs(clone_root, exist_ok=True)
+
+    return profile_name, clone_root
+
+def start_browsers(profile_name=None, custom_path=None, count=1, fast=False, isolate=False):
+    """Start `count` browsers; isolated ones run on their own copy of the profile"""
+    if not isolate:
+        return [setup_chrome_driver(profile_name, custom_path, fast=fast)]
+
+    # Copies of a temporary profile still need a visible window to log in
+    headless = bool(profile_name or custom_path)
+    start = lambda worker: setup_chrome_driver(*clone_profile(profile_name, custom_path, worker),
+                                               fast=fast, headless=headless)
+    # The first start downloads ChromeDriver if needed, the rest start side by side
+    drivers = [start(1)]
+    try:
+        if count > 1:
+            with ThreadPoolExecutor(max_workers=count - 1) as pool:
+                drivers.extend(pool.map(start, range(2, count + 1)))
+    except Exception:
+        for driver in drivers:
+            driver.quit()
+        raise
+    return drivers
 
-    input_file = sys.argv[1]
+def wait_for_grade_fields(driver, timeout=60):
+    """Wait until the current page shows the quick grading fields"""
+    WebDriverWait(driver, timeout).until(
+        EC.presence_of_element_located((By.CSS_SELECTOR, GRADE_FIELD_SELECTOR))
+    )
 
-    # Default Moodle URL (can be overridden)
-    moodle_url = "https://moodle.innopolis.university/mod/assign/view.php?id=131683&action=grading"
-    if len(sys.argv) > 2:
-        moodle_url = sys.argv[2]
+def wait_for_grading_table(driver, moodle_url, timeout=60, interactive=True):
+    """Open the grading page and return seconds until the quick grading inputs appear
+
+    If Moodle asks for a login, logs in again (see relogin) and reopens the page.
+    """
+    with tracer.span('page_load'), governor.request(moodle_url, 'page') as ticket:
+        start = time.perf_counter()
+        driver.get(moodle_url)
+        ticket['status'] = navigation_status(driver)
+        check_status(ticket['status'])
+        wait_for_page_or_login(driver, moodle_url, timeout)
+
+        if is_login_page(driver, moodle_url):
+            relogin(driver, moodle_url, interactive)
+            driver.get(moodle_url)
+            wait_for_page_or_login(driver, moodle_url, timeout)
+            if is_login_page(driver, moodle_url):
+                raise SessionExpiredError("still on the login page after logging in")
+
+        wait_for_grade_fields(driver, timeout)
+        return time.perf_counter() - start
+
+def compare_launch_profiles(moodle_url, profile_name=None, custom_path=None, runs=3):
+    """Measure page-ready time of the standard and fast launch profiles"""
+    if not (profile_name or custom_path):
+        print("❌ Comparing profiles needs a saved (logged in) profile, not a temporary one")
+        return None
+
+    results = {}
+    for label, fast in (('standard', False), ('fast', True)):
+        print(f"\n🚀 Starting Chrome ({label} profile)...")
+        driver = setup_chrome_driver(profile_name, custom_path, fast=fast)
+        timings = []
+        try:
+            for run in range(runs):
+                try:
+                    elapsed = wait_for_grading_table(driver, moodle_url, interactive=False)
+                except Exception:
+                    print(f"  ❌ Run {run + 1}: grading table not found (are you logged in?)")
+                    continue
+                timings.append(elapsed)
+                print(f"  ⏱  Run {run + 1}: {elapsed:.2f}s")
+        finally:
+            driver.quit()
+        results[label] = timings
+
+    print("\n" + "="*70)
+    print("⏱  PAGE-READY TIME COMPARISON")
+    print("="*70)
+    averages = {}
+    for label, timings in results.items():
+        if timings:
+            averages[label] = sum(timings) / len(timings)
+            print(f"  {label:<10} avg {averages[label]:.2f}s  "
+                  f"(min {min(timings):.2f}s, max {max(timings):.2f}s, {len(timings)} runs)")
+        else:
+            print(f"  {label:<10} no successful runs")
+
+    if len(averages) == 2 and averages['fast'] > 0:
+        speedup = averages['standard'] / averages['fast']
+        print(f"\n  {Fore.GREEN}Fast profile is {speedup:.1f}x faster than the standard profile{Style.RESET_ALL}")
+
+    return results
+
+def parse_args():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(
+        description="Bulk upload grades from CSV/Excel into Moodle quick grading",
+        epilog="CSV should have columns: Email, Student Name, Grade, Feedback. "
+               "Email is used as the primary unique identifier."
+    )
+    parser.add_argument('grades_file', nargs='?',
+                        help="CSV or Excel file with grades, or a JSON grade pipeline spec")
+    parser.add_argument('moodle_url', nargs='?', default=DEFAULT_MOODLE_URL,
+                        help="Moodle quick grading URL")
+    parser.add_argument('--fast', action='store_true',
+                        help="Headless launch with eager page load that blocks images, "
+                             "fonts, media and third-party hosts")
+    parser.add_argument('--profile', metavar='NAME|PATH|auto',
+                        help="Chrome profile to use without asking: 'auto' (the profile that most recently "
+                             "reached this Moodle host), 'temp', a Chrome profile such as 'Default', "
+                             "or a custom profile name or path (--yes defaults to auto)")
+    parser.add_argument('--profiles', action='store_true',
+                        help="List known profiles with the Moodle hosts they are logged in to, then exit")
+    parser.add_argument('--isolate', action='store_true',
+                        help="Run on a copy of the profile, so Chrome can stay open")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Browsers loading and saving shard pages side by side, each on its own "
+                             "copy of the profile (sharding mode, default: 1)")
+    parser.add_argument('--compare-profiles', action='store_true',
+                        help="Report page-ready time of the standard and fast profiles, then exit")
+    parser.add_argument('--max-grade', type=float,
+                        help="Maximum grade of the assignment (default: read from the page)")
+    parser.add_argument('--scale',
+                        help="Comma separated scale items, e.g. 'Fail,Pass,Merit' (default: read from the page)")
+    parser.add_argument('--shard-map',
+                        help="JSON file mapping each group to its grading page URL; "
+                             "pushes one master sheet to all of them (moodle_url is ignored)")
+    parser.add_argument('--shard-by', default='Groups',
+                        help="Column used to route rows to pages in sharding mode (default: Groups)")
+    parser.add_argument('--watch', action='store_true',
+                        help="After the first injection keep the browser open and push grade "
+                             "changes every time the grades file is saved")
+    parser.add_argument('--debounce', type=float, default=2.0,
+                        help="Seconds the file must stay unchanged before it is re-read in watch mode (default: 2)")
+    parser.add_argument('--auto-save', action='store_true',
+                        help="Click Moodle's save button after injecting, without asking")
+    parser.add_argument('--mode', choices=['skip_existing', 'overwrite'],
+                        help="Handle existing grades without asking: fill only empty ones, or overwrite all")
+    parser.add_argument('--yes', action='store_true',
+                        help="Unattended run: never prompt, save automatically (mode defaults to skip_existing)")
+    parser.add_argument('--retries', type=int, default=3,
+                        help="Retries with exponential backoff for page loads, extraction, "
+                             "injection and saving (default: 3)")
+    parser.add_argument('--rate', type=float, default=2.0,
+                        help="Maximum page loads/saves per second per Moodle host (default: 2)")
+    parser.add_argument('--max-concurrency', type=int, default=4,
+                        help="Maximum pages loading at once per Moodle host; lowered automatically "
+                             "when Moodle slows down or returns 429/5xx (default: 4)")
+    parser.add_argument('--history', default=os.path.expanduser("~/.moodle_grader_history.sqlite"),
+                        help="Grade history database (default: ~/.moodle_grader_history.sqlite)")
+    parser.add_argument('--no-history', action='store_true',
+                        help="Do not record this run in the grade history")
+    parser.add_argument('--history-student', metavar='EMAIL_OR_ID',
+                        help="Show every recorded grade change for a student, then exit")
+    parser.add_argument('--since', metavar='YYYY-MM-DD',
+                        help="Only show changes from this date on (with --history-student)")
+    parser.add_argument('--history-runs', action='store_true',
+                        help="List the latest recorded runs, then exit")
+    parser.add_argument('--rollback', type=int, metavar='RUN_ID',
+                        help="Write a CSV that restores the grades a run replaced, then exit")
+    parser.add_argument('--trace', action='store_true',
+                        help="Collect debug diagnostics (phase timings, event counts and a few examples) "
+                             "and print them at the end")
+    parser.add_argument('--trace-samples', type=int, default=3,
+                        help="Examples kept per traced event (default: 3)")
+    parser.add_argument('--report-dir', default='grade_reports',
+                        help="Directory for the full CSV/JSON/HTML reports (default: grade_reports)")
+    parser.add_argument('--top', type=int, default=10,
+                        help="Number of problem rows to show per section in the terminal (default: 10)")
+    parser.add_argument('--verbose', action='store_true',
+                        help="Print one line per student while matching")
+    args = parser.parse_args()
+    if not args.grades_file and not (args.history_student or args.history_runs or args.rollback or args.profiles):
+        parser.error("the grades_file argument is required")
+    if args.yes:
+        args.auto_save = True
+        args.mode = args.mode or 'skip_existing'
+        args.profile = args.profile or 'auto'
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.workers > 1 and not args.shard_map:
+        parser.error("--workers needs --shard-map (a single grading page uses one browser)")
+    if args.watch and args.shard_map:
+        parser.error("--watch works with a single grading page, not with --shard-map")
+    if args.watch and args.fast and not args.auto_save:
+        parser.error("--watch with --fast needs --auto-save (nothing can be saved in a headless browser)")
+    return args
+
+def main():
+    # Parse arguments
+    args = parse_args()
+    input_file = args.grades_file
+    moodle_url = args.moodle_url
+    governor.configure(rate=args.rate, max_concurrency=args.max_concurrency)
+    if args.trace:
+        tracer.enable(args.trace_samples)
+
+    # History queries answer from the local store, without Moodle
+    if run_history_query(args):
+        return
+    if args.profiles:
+        list_profiles()
+        return
+    history = None if args.no_history else GradeHistory(args.history)
 
     print("\n" + "="*70)
     print("🎯 SMART MOODLE GRADE INJECTOR v4 FINAL")
     print("   Complete Edition with Profile Management")
     print("="*70)
 
-    # Load grades from CSV
-    df = load_grades(input_file)
-
-    # Select Chrome profile
-    profile_name, custom_path = select_chrome_profile()
+    # Load grades from CSV (or compute them from a pipeline spec)
+    df = load_input(input_file)
 
-    print(f"\n🌐 Target URL: {moodle_url}")
+    # Select Chrome profile (logins are tracked per Moodle host)
+    target_url = next(iter(load_shard_map(args.shard_map).values()), moodle_url) if args.shard_map else moodle_url
+    profile_name, custom_path = select_chrome_profile(args.profile, target_url)
+    isolate = args.isolate or args.workers > 1
 
-    if profile_name or custom_path:
-        input("\nPress Enter to start (close Chrome if it's open)...")
+    if args.shard_map:
+        print(f"\n🌐 Target URLs: one per {args.shard_by} from {args.shard_map}")
     else:
-        print("\n⚠️  You'll need to log in to Moodle manually")
-        input("\nPress Enter to start...")
+        print(f"\n🌐 Target URL: {moodle_url}")
+
+    if args.compare_profiles:
+        compare_launch_profiles(moodle_url, profile_name, custom_path)
+        sys.exit(0)
+
+    if not args.yes:
+        if (profile_name or custom_path) and not isolate:
+            input("\nPress Enter to start (close Chrome if it's open)...")
+        elif profile_name or custom_path:
+            input("\nPress Enter to start...")
+        else:
+            print("\n⚠️  You'll need to log in to Moodle manually")
+            input("\nPress Enter to start...")
 
     # Setup Chrome
     print("\n🚀 Starting Chrome...")
+    headless = args.fast and bool(profile_name or custom_path)
 
     try:
-        driver = setup_chrome_driver(profile_name, custom_path)
-        print("✓ Chrome started successfully!")
+        drivers = start_browsers(profile_name, custom_path, args.workers, fast=args.fast, isolate=isolate)
+        driver = drivers[0]
+        print("✓ Chrome started successfully!" if len(drivers) == 1 else f"✓ {len(drivers)} Chrome windows started!")
     except Exception as e:
         print(f"\n❌ Error starting Chrome: {e}")
 
         if "user data directory" in str(e).lower():
             print("\n💡 SOLUTION: Close ALL Chrome windows and try again!")
-            print("   Or select a different profile option.")
+            print("   Or select a different profile option, or use --isolate to run on a copy of it.")
 
         sys.exit(1)
 
     try:
-        # Navigate to Moodle
-        print(f"\n📍 Navigating to Moodle...")
-        driver.get(moodle_url)
+        if args.shard_map:
+            run_shards(drivers, df, input_file, args, headless, history, (profile_name, custom_path))
+            return
 
-        # Wait for page load
+        # Navigate to Moodle and wait for the grading table
+        print(f"\n📍 Navigating to Moodle...")
         print("\n⏳ Waiting for page to load...")
         if not (profile_name or custom_path):
             print("   (Please log in if prompted)")
 
-        # Wait for grading table
         try:
-            WebDriverWait(driver, 60).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, "input[name^='quickgrade_']"))
-            )
-            print("✓ Grading page loaded!")
-        except:
+            elapsed = with_retries(lambda: wait_for_grading_table(driver, moodle_url, interactive=not args.yes),
+                                   "Loading the grading page", args.retries)
+            print(f"✓ Grading page loaded! (ready in {elapsed:.2f}s)")
+            mark_login(profile_name, custom_path, moodle_url)
+        except (WebDriverException, SessionExpiredError):
             print("\n❌ Timeout: Could not find grading table")
             print("   Make sure:")
             print("   - You're logged in")
             print("   - Quick grading is enabled")
             print("   - You're on the correct page")
-            input("\nPress Enter to close browser...")
+            if not args.yes:
+                input("\nPress Enter to close browser...")
             driver.quit()
             sys.exit(1)
 
-        # Wait for full page load
-        time.sleep(2)
-
-        # Extract student data from Moodle page
-        print("\n🔍 Extracting student data from Moodle...")
-        moodle_students = extract_student_data_from_page(driver)
-        print(f"✓ Found {len(moodle_students)} students on Moodle page")
-
-        # If no students found, try simpler extraction
-        if len(moodle_students) == 0:
-            print("⚠️  No students found with email extraction, trying name-only extraction...")
-            js_simple = """
-            var students = {};
-            var inputs = document.querySelectorAll('input[name^="quickgrade_"]');
-            for (var i = 0; i < inputs.length; i++) {
-                var id = inputs[i].name.replace('quickgrade_', '');
-                students[id] = {
-                    id: id,
-                    email: '',
-                    name: 'Student_' + id,
-                    current_grade: inputs[i].value || '',
-                    field_exists: true
-                };
-            }
-            return students;
-            """
-            moodle_students = driver.execute_script(js_simple)
-            print(f"✓ Found {len(moodle_students)} grade input fields")
+        # Wait for full page load (the fast profile only needs the DOM)
+        if not args.fast:
+            time.sleep(2)
 
-            if len(moodle_students) > 0:
-                print("\n⚠️  NOTE: Could not extract emails from page.")
-                print("   Will use the hardcoded ID mappings instead.")
-
-        # Map CSV grades to Moodle students
-        matched_grades, unmatched, multiple_matches = map_grades_to_students(df, moodle_students)
+        page = prepare_page(driver, df, moodle_url, args)
+        matched_grades, unmatched, multiple_matches = page['matched'], page['unmatched'], page['ambiguous']
+        invalid_grades = page['invalid']
 
         # Display analysis
-        empty_grades, filled_grades = display_analysis(matched_grades, unmatched, multiple_matches)
+        empty_grades, filled_grades = display_analysis(matched_grades, unmatched, multiple_matches, top=args.top)
+
+        # Full per-student analysis goes to the report files
+        counts, report_paths = write_reports(
+            args.report_dir,
+            iter_report_rows(matched_grades, unmatched, multiple_matches, invalid_grades),
+            title=f"Grade matching report: {os.path.basename(input_file)}"
+        )
+        print(f"\n📄 Full report ({sum(counts.values())} rows): {report_paths['html']}")
+        print(f"   Also as CSV/JSON: {report_paths['csv']}, {report_paths['json']}")
 
         if not matched_grades:
             print(f"\n{Fore.RED}❌ No students could be matched! Check your CSV file.{Style.RESET_ALL}")
@@ -854,7 +2975,7 @@ def main():
             sys.exit(1)
 
         # Get user choice
-        choice = get_user_choice(filled_grades, unmatched)
+        choice = get_user_choice(filled_grades, unmatched, args.mode)
 
         if choice == 'cancel':
             print("\n❌ Operation cancelled by user")
@@ -863,42 +2984,33 @@ def main():
 
         # Inject grades based on choice
         print(f"\n💉 Injecting grades (mode: {choice})...")
-        stats = inject_grades_smart(driver, matched_grades, choice)
-
-        # Display results
-        print("\n" + "="*70)
-        print("✅ INJECTION COMPLETE!")
-        print("="*70)
-        if stats['filled_new'] > 0:
-            print(f"  {Fore.GREEN}✓ New grades filled: {stats['filled_new']}{Style.RESET_ALL}")
-        if stats['overwritten'] > 0:
-            print(f"  {Fore.YELLOW}✓ Grades overwritten: {stats['overwritten']}{Style.RESET_ALL}")
-        if stats['skipped'] > 0:
-            print(f"  {Fore.CYAN}○ Grades skipped: {stats['skipped']}{Style.RESET_ALL}")
-        if stats['errors'] > 0:
-            print(f"  {Fore.RED}✗ Errors: {stats['errors']}{Style.RESET_ALL}")
-
-        print("\n📌 COLOR GUIDE:")
-        print(f"  {Fore.GREEN}Green fields{Style.RESET_ALL} = New grades added")
-        print(f"  {Fore.YELLOW}Orange fields{Style.RESET_ALL} = Existing grades overwritten")
-        print(f"  {Fore.CYAN}Yellow fields{Style.RESET_ALL} = Skipped (already had grades)")
-
-        print("\n" + "="*70)
-        print("📌 NEXT STEPS:")
-        print("="*70)
-        print("1. Review the colored grade fields")
-        print("2. Click the green 'Save all quick grading changes' button")
-        print("3. Wait for Moodle to confirm the save")
-
-        input("\nPress Enter after you've saved the grades...")
+        stats, applied = apply_grades(driver, matched_grades, choice, moodle_url, args)
+
+        print_injection_stats(stats, headless)
+
+        if args.watch:
+            status = 'injected, not saved'
+            if args.auto_save:
+                applied = save_and_reload(driver, moodle_url, page, applied, args)
+                status = 'saved'
+            record_history(history, [(moodle_url, status, applied, stats)], choice, input_file)
+            watch_grades_file(driver, input_file, df, page, args, history,
+                              unsaved=None if args.auto_save else applied)
+        else:
+            results = finish_save([(driver, driver.current_window_handle, moodle_url, applied, stats)], args, headless)
+            record_history(history, results, choice, input_file)
+            governor.print_status()
 
     except KeyboardInterrupt:
         print("\n\n❌ Interrupted by user")
     except Exception as e:
         print(f"\n❌ Error: {e}")
-        input("\nPress Enter to close browser...")
+        if not args.yes:
+            input("\nPress Enter to close browser...")
     finally:
-        driver.quit()
+        for browser in drivers:
+            browser.quit()
+        tracer.report()
         print("\n👍 Browser closed. Done!")
 
 if __name__ == "__main__":